@@ -0,0 +1,90 @@
+"""Замер времени поиска столкновений за кадр до и после перехода на сетку.
+
+Запуск:
+```sh
+poetry run python bench/collision.py
+```"""
+
+import os
+import sys
+import random
+import timeit
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "corpse"))
+
+import esper
+import utils  # noqa: F401 (модули движка импортируются через utils)
+import pygame
+
+from movement import Velocity
+from location import Position
+from spatial import SpatialIndex, bounds
+from render import Collision, CollisionHandlingProcessor, Sprite
+
+# Доля динамических (имеющих Velocity) сущностей на карте.
+DYNAMIC_SHARE = 0.1
+
+
+class BruteForceCollisionHandlingProcessor(esper.Processor):
+    """Прежняя реализация: сравнение масок каждого спрайта с каждым."""
+
+    def process(self, **_):
+        for entity1, render1 in self.world.get_component(Sprite):
+            collides = []
+            for entity2, render2 in self.world.get_component(Sprite):
+                if entity1 == entity2:
+                    continue
+                if pygame.sprite.collide_mask(render1.sprite, render2.sprite):
+                    collides.append(entity2)
+            self.world.add_component(entity1, Collision(collides))
+
+
+def make_world(n: int, processor: esper.Processor) -> esper.World:
+    rng = random.Random(n)
+    world = esper.World()
+    location = world.create_entity(SpatialIndex())
+    grid = world.component_for_entity(location, SpatialIndex).grid
+
+    # Плотность объектов примерно как у заполненной карты: ~1 объект на 64x64.
+    side = int((n**0.5) * 64)
+
+    for _ in range(n):
+        w, h = rng.randint(16, 48), rng.randint(16, 48)
+        image = pygame.Surface((w, h), pygame.SRCALPHA)
+        pygame.draw.ellipse(image, (255, 255, 255), image.get_rect())
+
+        sprite = pygame.sprite.Sprite()
+        sprite.image = image
+        coords = pygame.Vector2(rng.randint(0, side), rng.randint(0, side))
+        sprite.rect = image.get_rect(center=coords)
+        sprite.mask = pygame.mask.from_surface(image)
+
+        render = Sprite(image, sprite)
+        entity = world.create_entity(render, Position(location, coords))
+
+        if rng.random() < DYNAMIC_SHARE:
+            world.add_component(entity, Velocity(pygame.Vector2(0)))
+
+        grid.insert(entity, bounds(render, coords))
+
+    world.add_processor(processor)
+
+    return world
+
+
+def bench(n: int, processor: esper.Processor, frames: int) -> float:
+    world = make_world(n, processor)
+    return timeit.timeit(world.process, number=frames) / frames * 1000
+
+
+if __name__ == "__main__":
+    pygame.init()
+
+    print(f"{'спрайтов':>9} {'до, мс':>10} {'после, мс':>10} {'ускорение':>10}")
+
+    for n in (100, 500, 2000):
+        frames = max(1, 2000 // n)
+        before = bench(n, BruteForceCollisionHandlingProcessor(), frames)
+        after = bench(n, CollisionHandlingProcessor(), frames * 10)
+        print(f"{n:>9} {before:>10.2f} {after:>10.2f} {before / after:>9.1f}x")
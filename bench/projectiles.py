@@ -0,0 +1,115 @@
+"""Замер времени кадра с 10 000 одновременно летящих пуль: пули-сущности
+(ShootingProcessor и MovementProcessor) против массивов NumPy
+(ProjectileProcessor).
+
+Запуск:
+```sh
+poetry install -E projectiles
+poetry run python bench/projectiles.py
+```"""
+
+import os
+import sys
+import random
+import timeit
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "corpse"))
+
+import esper
+import utils  # noqa: F401 (модули движка импортируются через utils)
+import pygame
+
+from item import Gun
+from object import Intangible, Solid
+from location import Location, Position
+from movement import MovementProcessor, Velocity
+from spatial import SpatialIndex
+from shoot import Bullet, ShootingProcessor
+from creature import Damage, DamageRequest, Health
+from projectile import ProjectileProcessor, Projectiles, np
+
+BULLETS = 10_000
+TARGETS = 400
+FRAMES = 20
+
+# Сторона квадратной арены в пикселях.
+SIDE = 4096
+
+
+def make_world(projectiles: bool) -> esper.World:
+    rng = random.Random(BULLETS)
+    world = esper.World()
+    location = world.create_entity(Location(None, None, None), SpatialIndex())
+    grid = world.component_for_entity(location, SpatialIndex).grid
+    gun = world.create_entity(Gun("pistol_ammo", 0, range=SIDE))
+
+    # Половина целей - неубиваемые существа, половина - твёрдые ящики.
+    for i in range(TARGETS):
+        rect = pygame.Rect(0, 0, 32, 32)
+        rect.center = rng.randint(0, SIDE), rng.randint(0, SIDE)
+        comp = Health(float("inf")) if i % 2 else Solid()
+        grid.insert(world.create_entity(comp), rect)
+
+    if projectiles:
+        pool = Projectiles()
+        world.add_component(location, pool)
+        world.add_processor(ProjectileProcessor())
+    else:
+        world.add_processor(ShootingProcessor())
+        world.add_processor(MovementProcessor())
+
+    for _ in range(BULLETS):
+        coords = pygame.Vector2(rng.randint(0, SIDE), rng.randint(0, SIDE))
+        angle = rng.uniform(0, 360)
+
+        if projectiles:
+            pool.add(coords, angle, gun, SIDE, 1)
+        else:
+            world.create_entity(
+                Bullet(gun, gun, coords.copy(), SIDE),
+                Position(location, coords),
+                Velocity(utils.math.angle_vector(angle) * utils.consts.BULLET_SPEED),
+                Damage(1),
+                Intangible(),
+            )
+
+    return world
+
+
+def bench(projectiles: bool) -> tuple:
+    world = make_world(projectiles)
+    hits = 0
+
+    def frame():
+        nonlocal hits
+
+        world.process()
+
+        for entity, _ in world.get_component(DamageRequest):
+            hits += 1
+            world.delete_entity(entity)
+
+    elapsed = timeit.timeit(frame, number=FRAMES) / FRAMES * 1000
+
+    if projectiles:
+        alive = world.get_component(Projectiles)[0][1].count
+    else:
+        # Припаркованные в пуле пули сохраняют Bullet, но не Position.
+        alive = len(world.get_components(Bullet, Position))
+
+    return elapsed, hits, alive
+
+
+if __name__ == "__main__":
+    if np is None:
+        sys.exit("Нужен NumPy: poetry install -E projectiles")
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+
+    print(f"{'пули':>12} {'мс/кадр':>10} {'попаданий':>10} {'осталось':>10}")
+
+    for name, projectiles in (("сущности", False), ("NumPy", True)):
+        elapsed, hits, alive = bench(projectiles)
+        print(f"{name:>12} {elapsed:>10.2f} {hits:>10} {alive:>10}")
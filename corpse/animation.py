@@ -1,11 +1,13 @@
 from pygame_menu import Menu
 from meta import Id
+import os
 import utils
 import esper
 import pygame
 
 from enum import Enum, auto
-from typing import Dict, Optional, Set, Tuple
+from utils.fs import ResourcePath, dir_count
+from typing import Callable, Dict, Optional, Set, Tuple
 from dataclasses import dataclass as component
 
 from ai import Enemy
@@ -49,6 +51,82 @@ class Animation:
     _delay: int = 0
 
 
+class CreatureFrames:
+    """Кадры существа из каталога data/frames/<id>: кадры тела, частей тела
+    и состояний. Каталог читается один раз, а кортежи кадров общие для всех
+    экземпляров существа, поэтому их нельзя изменять.
+
+    Параметры:
+    id: строковый идентификатор существа
+    load: функция, загружающая кадр по имени каталога и номеру кадра (с
+    нуля)."""
+
+    def __init__(self, id: str, load: Callable[[str, int], pygame.surface.Surface]):
+        self.id = id
+        self.dirs: Dict[str, Tuple[pygame.surface.Surface, ...]] = {}
+        self.states: Dict[StateType, Tuple[pygame.surface.Surface, ...]] = {}
+
+        for name in sorted(os.listdir(ResourcePath.frame(id))):
+            if not os.path.isdir(path := ResourcePath.frame(id, name)):
+                continue
+
+            self.dirs[name] = tuple(load(name, i) for i in range(dir_count(path)))
+
+            try:
+                state = StateType.from_str(name) if name != "body" else StateType.Stands
+            except KeyError:
+                continue
+
+            self.states[state] = self.dirs[name]
+
+    @property
+    def body(self) -> Tuple[pygame.surface.Surface, ...]:
+        return self.dirs["body"]
+
+    def part(self, name: str) -> Tuple[pygame.surface.Surface, ...]:
+        return self.dirs[name]
+
+
+# Загруженные кадры существ по их идентификаторам.
+CREATURE_FRAMES: Dict[str, CreatureFrames] = {}
+
+
+def creature_frames(
+    id: str,
+    surface_preprocessor: Optional[
+        Callable[[pygame.surface.Surface], pygame.surface.Surface]
+    ] = None,
+    rotation_steps: Optional[int] = None,
+) -> CreatureFrames:
+    """Возвращает кадры существа, загружая их при первом обращении. Каждый
+    кадр обрабатывается surface_preprocessor и, если указано rotation_steps,
+    заранее поворачивается на rotation_steps углов (см. transform.atlas).
+
+    Кадры общие для всех существ с одним id, поэтому одно и то же существо
+    должно загружаться с одной и той же предобработкой кадров."""
+
+    import asset
+    from transform import atlas
+
+    if (frames := CREATURE_FRAMES.get(id)) is not None:
+        return frames
+
+    def load(name, idx):
+        surf = asset.load(ResourcePath.frame(id, name, idx=idx + 1))
+
+        if surface_preprocessor:
+            surf = surface_preprocessor(surf)
+
+        if rotation_steps:
+            atlas(id, rotation_steps).bake(surf)
+
+        return asset.register(surf, "frame", id, name, idx)
+
+    frames = CREATURE_FRAMES[id] = CreatureFrames(id, load)
+
+    return frames
+
+
 class PartType(Enum):
     Legs = auto()
 
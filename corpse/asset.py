@@ -0,0 +1,166 @@
+import os
+import pygame
+import pytmx
+import weakref
+
+from pack import packed
+from utils.cache import LRUCache
+from utils.consts import ASSET_CACHE_BYTES
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+
+# Ссылка на ассет - кортеж, первый элемент которого - вид ассета, а
+# остальные - аргументы загрузчика этого вида ассетов. По ссылке можно
+# восстановить поверхность, не сохраняя её пиксели (см. chunk.ChunkStore).
+Ref = Tuple[Hashable, ...]
+
+
+class AssetError(Exception):
+    pass
+
+
+class UnknownAssetKindError(AssetError):
+    pass
+
+
+_LOADERS: Dict[str, Callable[..., pygame.surface.Surface]] = {}
+
+# Ссылки зарегистрированных поверхностей и поверхности, восстановленные по
+# ссылкам. Поверхности не удерживаются реестром в памяти.
+_REFS: "weakref.WeakKeyDictionary[pygame.surface.Surface, Ref]" = (
+    weakref.WeakKeyDictionary()
+)
+_RESOLVED: "weakref.WeakValueDictionary[Ref, pygame.surface.Surface]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def loader(kind: str):
+    """Декоратор, регистрирующий загрузчик ассетов вида kind. Загрузчик
+    принимает остальные элементы ссылки и возвращает поверхность."""
+
+    def decorator(func: Callable[..., pygame.surface.Surface]):
+        _LOADERS[kind] = func
+        return func
+
+    return decorator
+
+
+def register(
+    surface: pygame.surface.Surface, kind: str, *key: Hashable
+) -> pygame.surface.Surface:
+    """Запоминает, что поверхность можно получить по ссылке (kind, *key), и
+    возвращает эту же поверхность.
+
+    Пример использования:
+    ```python
+    image = asset.register(image, "tile", "sandbox/map", gid, (32, 32))
+    asset.ref(image)  # ("tile", "sandbox/map", gid, (32, 32))
+    ```"""
+
+    ref = (kind, *key)
+
+    _REFS[surface] = ref
+    _RESOLVED.setdefault(ref, surface)
+
+    return surface
+
+
+def ref(surface: pygame.surface.Surface) -> Optional[Ref]:
+    """Возвращает ссылку на поверхность или None, если поверхность не
+    зарегистрирована."""
+
+    return _REFS.get(surface)
+
+
+def resolve(ref: Ref) -> pygame.surface.Surface:
+    """Возвращает поверхность по ссылке, загружая её при необходимости.
+    Пока восстановленная поверхность используется, повторные вызовы
+    возвращают её же."""
+
+    if (surface := _RESOLVED.get(ref)) is not None:
+        return surface
+
+    kind, *key = ref
+
+    if kind not in _LOADERS:
+        raise UnknownAssetKindError(f"Неизвестный вид ассетов: {kind}")
+
+    return register(_LOADERS[kind](*key), *ref)
+
+
+def _surface_bytes(surface: pygame.surface.Surface) -> int:
+    w, h = surface.get_size()
+    return w * h * surface.get_bytesize()
+
+
+# Общие для всей игры изображения, загруженные с диска, по пути к файлу и
+# параметрам обработки.
+IMAGES = LRUCache(maxweight=ASSET_CACHE_BYTES, weigh=_surface_bytes)
+
+
+@loader("image")
+def load(
+    path: str,
+    alpha: bool = True,
+    rotate: float = 0,
+    scale: Optional[Tuple[int, int]] = None,
+) -> pygame.surface.Surface:
+    """Возвращает общее изображение из файла path, загружая его с диска только
+    при первом обращении. Изображение обрабатывается в порядке: convert_alpha
+    (если alpha), масштабирование до scale, поворот на rotate градусов.
+
+    Если изображение упаковано в атлас (см. pack.py), вместо чтения файла
+    возвращается подповерхность страницы атласа.
+
+    Возвращаемое изображение используется многими сущностями одновременно,
+    поэтому изменять его нельзя - только его копии."""
+
+    path = os.path.realpath(path)
+    ref = ("image", path, alpha, rotate, scale)
+
+    def decode():
+        if alpha and (image := packed(path)) is not None:
+            return image
+
+        image = pygame.image.load(path)
+        return image.convert_alpha() if alpha else image.convert()
+
+    def make():
+        image = load(path, alpha) if rotate or scale else decode()
+
+        if scale:
+            image = pygame.transform.scale(image, scale)
+        if rotate:
+            image = pygame.transform.rotate(image, rotate)
+
+        return register(image, *ref)
+
+    return IMAGES.get_or_make(ref, make)
+
+
+@loader("frame")
+def _load_creature_frame(id: str, name: str, idx: int) -> pygame.surface.Surface:
+    """Кадр существа (см. animation.creature_frames)."""
+
+    from animation import CREATURE_FRAMES
+
+    return CREATURE_FRAMES[id].dirs[name][idx]
+
+
+# Загруженные карты Tiled по идентификаторам локаций.
+MAPS: Dict[str, pytmx.TiledMap] = {}
+
+
+@loader("tile")
+def _load_tile(
+    location_id: str, gid: int, size: Optional[Tuple[int, int]]
+) -> pygame.surface.Surface:
+    """Изображение тайла карты локации, при необходимости масштабированное."""
+
+    image = MAPS[location_id].images[gid].convert_alpha()
+
+    if size:
+        image = pygame.transform.scale(image, size)
+
+    return image
@@ -1,49 +1,663 @@
+import io
+import os
+import atexit
+import shutil
+import logging
+import tempfile
+import asset
 import esper
-import pygame
 import utils
+import pickle
+import pygame
 
-from creature import PlayerMarker
 from location import Position
-from typing import Tuple
+from spatial import Cell, SpatialIndex, bounds
+from render import (
+    Collision,
+    DynamicSprite,
+    MakeRenderableRequest,
+    Sprite,
+    SpriteChanges,
+    SpriteHiddenMarker,
+    SpriteImageChangedMarker,
+    mark_changed,
+)
+from math import floor
+from time import perf_counter
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+from dataclasses import field
+from dataclasses import dataclass as component
+
+
+@component
+class Inactive:
+    """Маркер неактивной сущности, находящейся вдали от игрока. Все компоненты
+    сущности, кроме позиции, снимаются с неё и хранятся здесь, поэтому
+    процессоры её не видят, а id сущности и ссылки на неё остаются
+    действительными.
+
+    Параметры компонента:
+    components: снятые с сущности компоненты."""
+
+    components: Tuple = ()
+
+
+class ChunkGrid:
+    """Разбиение карты на чанки - квадраты со стороной в size пикселей.
+    Хранит множество сущностей каждого чанка и чанк каждой сущности, поэтому
+    проверка и смена чанка сущности выполняются за O(1). В отличие от
+    пространственного индекса, в сетке остаются и неактивные сущности.
+
+    Параметры:
+    size: размер стороны чанка в пикселях."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.chunks: Dict[Cell, Set[int]] = {}
+        self.crossed: Set[int] = set()
+        self._where: Dict[int, Cell] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, entity: int) -> bool:
+        return entity in self._where
+
+    def chunk(self, point: Tuple[float, float]) -> Cell:
+        """Возвращает координаты чанка, в который попадает точка."""
+
+        x, y = point
+        return floor(x / self.size), floor(y / self.size)
+
+    def where(self, entity: int) -> Optional[Cell]:
+        return self._where.get(entity)
+
+    def add(self, entity: int, point: Tuple[float, float]):
+        """Добавляет сущность в чанк, в который попадает точка."""
+
+        if entity in self._where:
+            return self.move(entity, point)
+
+        self._where[entity] = chunk = self.chunk(point)
+        self.chunks.setdefault(chunk, set()).add(entity)
+
+    def remove(self, entity: int):
+        """Удаляет сущность из сетки. Отсутствие сущности не является ошибкой."""
+
+        if (chunk := self._where.pop(entity, None)) is None:
+            return
+
+        bucket = self.chunks[chunk]
+        bucket.discard(entity)
+        if not bucket:
+            del self.chunks[chunk]
+
+        self.crossed.discard(entity)
+
+    def move(self, entity: int, point: Tuple[float, float]):
+        """Переносит сущность в чанк, в который попадает точка. Сущности,
+        сменившие чанк, запоминаются в crossed."""
+
+        if (old := self._where.get(entity)) is None:
+            return
+
+        if self.chunk(point) == old:
+            return
+
+        self.remove(entity)
+        self.add(entity, point)
+        self.crossed.add(entity)
+
+    def ring(
+        self, point: Tuple[float, float], extent: Tuple[float, float]
+    ) -> Set[Cell]:
+        """Возвращает чанки, которые пересекает прямоугольник с центром в point
+        и полуразмерами extent."""
+
+        x, y = point
+        w, h = extent
+        x1, y1 = self.chunk((x - w, y - h))
+        x2, y2 = self.chunk((x + w, y + h))
+
+        return {(cx, cy) for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1)}
+
+    def near(self, point: Tuple[float, float], radius: int = 1) -> Set[int]:
+        """Возвращает сущности из чанков, удалённых от чанка точки не более
+        чем на radius чанков по каждой из осей."""
+
+        cx, cy = self.chunk(point)
+        found = set()
+        chunks = self.chunks
+
+        for x in range(cx - radius, cx + radius + 1):
+            for y in range(cy - radius, cy + radius + 1):
+                if bucket := chunks.get((x, y)):
+                    found |= bucket
+
+        return found
+
+
+class _Pickler(pickle.Pickler):
+    """Сериализует поверхности как ссылки на ассеты."""
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, pygame.surface.Surface):
+            return None
+
+        if (ref := asset.ref(obj)) is None:
+            raise pickle.PicklingError("Поверхность не зарегистрирована как ассет")
+
+        return ref
+
+
+class _Unpickler(pickle.Unpickler):
+    def persistent_load(self, ref):
+        return asset.resolve(ref)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Компоненты, которые вычисляются из остальных и не сохраняются в хранилище
+# чанков. Вместо Sprite сохраняется запрос на его повторное создание.
+_DERIVED = (
+    Collision,
+    DynamicSprite,
+    SpriteChanges,
+    SpriteHiddenMarker,
+    SpriteImageChangedMarker,
+)
+
+
+def _portable(components: Iterable) -> List:
+    portable = []
+
+    for comp in components:
+        if isinstance(comp, Sprite):
+            portable.append(MakeRenderableRequest())
+        elif not isinstance(comp, _DERIVED):
+            portable.append(comp)
+
+    return portable
+
+
+class ChunkStore:
+    """Хранилище выгруженных чанков на диске. Компоненты неактивных сущностей
+    чанка сериализуются в отдельный файл, а поверхности заменяются ссылками
+    на ассеты (см. asset.ref). Сущности, которые сериализовать нельзя
+    (например, с незарегистрированными поверхностями), остаются в памяти.
+
+    Чтение и запись файлов выполняются в фоновом потоке. Поток один, поэтому
+    операции над одним и тем же чанком выполняются в порядке их вызова.
+    Десериализация загружает изображения через asset.resolve, а SDL и
+    реестры ассетов не потокобезопасны, поэтому она выполняется в основном
+    потоке (см. load).
+
+    id сущностей действительны только в рамках одного запуска, поэтому
+    каждое хранилище пишет в свой новый подкаталог path, который удаляется
+    при выходе из программы (см. close). Файлы, оставшиеся от прошлых
+    запусков, никогда не читаются.
+
+    Параметры:
+    path: каталог, в котором создаётся каталог хранилища."""
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+
+        self.path = tempfile.mkdtemp(prefix="session-", dir=path)
+        self.stored: Set[Cell] = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="chunk-store"
+        )
+
+        atexit.register(self.close)
+
+    def __contains__(self, chunk: Cell) -> bool:
+        return chunk in self.stored
+
+    def _file(self, chunk: Cell) -> str:
+        x, y = chunk
+        return os.path.join(self.path, f"{x}_{y}.pickle")
+
+    def _read(self, chunk: Cell) -> Dict[int, bytes]:
+        with open(self._file(chunk), "rb") as file:
+            return pickle.load(file)
+
+    def _write(self, chunk: Cell, blobs: Dict[int, bytes], merge: bool):
+        if merge and os.path.exists(self._file(chunk)):
+            blobs = {**self._read(chunk), **blobs}
+
+        with open(self._file(chunk), "wb") as file:
+            pickle.dump(blobs, file)
+
+    def _take(self, chunk: Cell) -> Dict[int, bytes]:
+        blobs = self._read(chunk)
+        os.remove(self._file(chunk))
+
+        return blobs
+
+    def load(self, blob: bytes) -> Dict[int, Tuple]:
+        """Десериализует группу сущностей, загруженную fetch. Вызывается
+        только из основного потока."""
+
+        return _Unpickler(io.BytesIO(blob)).load()
+
+    def dump(self, group: Dict[int, Tuple]) -> Optional[bytes]:
+        """Сериализует компоненты группы сущностей. Возвращает None, если
+        группу сериализовать нельзя."""
+
+        buffer = io.BytesIO()
+
+        try:
+            _Pickler(buffer).dump(group)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+
+        return buffer.getvalue()
+
+    def save(self, chunk: Cell, blobs: Dict[int, bytes]):
+        """Записывает сериализованные группы сущностей чанка в фоне, дополняя
+        сохранённые в хранилище раньше."""
+
+        merge = chunk in self.stored
+        self.stored.add(chunk)
+        self._executor.submit(self._write, chunk, blobs, merge)
+
+    def fetch(self, chunk: Cell) -> Future:
+        """Начинает чтение чанка в фоне и удаляет его из хранилища. Результат
+        - сериализованные группы сущностей чанка по id корневой сущности (см.
+        load)."""
+
+        self.stored.discard(chunk)
+        return self._executor.submit(self._take, chunk)
+
+    def close(self):
+        """Дожидается фоновых операций и удаляет каталог хранилища."""
+
+        self._executor.shutdown(wait=True)
+        self.stored.clear()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@component
+class Chunks:
+    """Чанки локации и состояние их активации.
+
+    Параметры компонента:
+    grid: сетка чанков
+    active: чанки в радиусе игрока, сущности в которых активны
+    store: хранилище выгруженных чанков (None - неактивные сущности
+    остаются в памяти)
+    loading: чанки, загружаемые из хранилища в фоне
+    arrivals: прочитанные из хранилища сериализованные группы сущностей,
+    ожидающие добавления в базу данных сущностей
+    queue: чанки, сущности которых ещё нужно (де)активировать
+    prefetched: загруженные заранее чанки, которые ещё не вошли в радиус
+    игрока."""
+
+    grid: ChunkGrid
+    active: Set[Cell] = field(default_factory=set)
+    store: Optional[ChunkStore] = None
+    loading: Dict[Cell, Future] = field(default_factory=dict)
+    arrivals: Deque[Tuple[Cell, int, bytes]] = field(
+        default_factory=deque
+    )
+    queue: Dict[Cell, None] = field(default_factory=dict)
+    prefetched: Set[Cell] = field(default_factory=set)
+
+    # Счётчики для подбора радиусов: сколько сущностей ждёт перехода в
+    # очереди и сколько перешло в текущем кадре.
+    queued: int = 0
+    activated: int = 0
+    deactivated: int = 0
+
+
+def near(
+    world: esper.World, coords: Tuple[float, float], radius: int = 1
+) -> Set[int]:
+    """Возвращает сущности (в том числе неактивные) из чанков локации вокруг
+    coords. Подходит для грубого отбора кандидатов перед точной проверкой."""
 
+    location_id = utils.get.location(world, id=True)[0]
 
-class ChunkUnloadingProcessor(esper.Processor):
-    def process(self, screen_size: Tuple[int, int], world: esper.World):
-        w, h = screen_size
+    if not (chunks := world.try_component(location_id, Chunks)):
+        return set()
 
-        ppos = utils.get.player(world, Position)
+    return chunks.grid.near(coords, radius)
 
-        if not ppos:
+
+def deactivate(world: esper.World, entity: int):
+    """Снимает с сущности все компоненты, кроме позиции, и убирает её спрайт
+    из отрисовки и пространственного индекса. Части существа (см.
+    animation.Part) деактивируются вместе с ним."""
+
+    from animation import Animation
+
+    location = utils.get.location(world)
+    components = world.components_for_entity(entity)
+
+    for comp in components:
+        if isinstance(comp, Sprite):
+            location.sprites.remove(comp.sprite)
+
+            for _, index in world.get_component(SpatialIndex):
+                index.grid.remove(entity)
+        elif isinstance(comp, Animation) and comp.children:
+            for part in comp.children:
+                if world.entity_exists(part) and not world.has_component(
+                    part, Inactive
+                ):
+                    deactivate(world, part)
+
+    stashed = tuple(
+        comp for comp in components if not isinstance(comp, (Position, SpriteChanges))
+    )
+
+    world.add_component(entity, Inactive(stashed))
+
+    for comp in components:
+        if not isinstance(comp, Position):
+            world.remove_component(entity, type(comp))
+
+
+def activate(world: esper.World, entity: int):
+    """Возвращает неактивной сущности и её частям их компоненты."""
+
+    from object import Intangible
+    from animation import Animation
+
+    if not (
+        world.entity_exists(entity)
+        and (inactive := world.try_component(entity, Inactive))
+    ):
+        return
+
+    world.remove_component(entity, Inactive)
+
+    for comp in inactive.components:
+        world.add_component(entity, comp)
+
+    if render := world.try_component(entity, Sprite):
+        pos = world.component_for_entity(entity, Position)
+
+        if not world.has_component(entity, Intangible) and (
+            index := world.try_component(pos.location, SpatialIndex)
+        ):
+            index.grid.insert(entity, bounds(render, pos.coords))
+
+        mark_changed(world, entity)
+
+    if (ani := world.try_component(entity, Animation)) and ani.children:
+        for part in ani.children:
+            activate(world, part)
+
+
+class ChunkActivatingProcessor(esper.Processor):
+    """Активирует сущности вблизи игрока и деактивирует далёкие. Чанки
+    активируются, входя в радиус загрузки (load экранов от игрока), а
+    деактивируются, только покинув больший радиус выгрузки (unload экранов),
+    поэтому сущность у границы не переключается туда и обратно каждый кадр.
+
+    Набор чанков в радиусах сравнивается с набором из прошлого кадра, и в
+    очередь попадают только вошедшие и покинувшие их чанки. За кадр
+    (де)активируется не больше limit сущностей, остальные ждут в очереди.
+    Кроме того, проверяются сущности, сменившие чанк, и новые сущности.
+
+    Если задан store_path, неактивные сущности покинувших радиус чанков
+    выгружаются на диск и загружаются обратно под теми же id, когда чанк
+    снова входит в радиус. Чанки загружаются в фоне, причём заранее - те,
+    что окажутся в радиусе, если игрок продолжит двигаться в том же
+    направлении. В основном потоке загруженные сущности лишь добавляются в
+    базу данных сущностей, и не дольше budget миллисекунд за кадр."""
+
+    def __init__(
+        self,
+        store_path: Optional[str] = utils.consts.CHUNK_STORE_PATH,
+        budget: float = utils.consts.CHUNK_INSERT_BUDGET,
+        load: float = utils.consts.CHUNK_LOAD_DISTANCE,
+        unload: float = utils.consts.CHUNK_UNLOAD_DISTANCE,
+        limit: int = utils.consts.CHUNK_TRANSITIONS_PER_FRAME,
+    ):
+        self.store_path = store_path
+        self.budget = budget
+        self.load = load
+        self.unload = max(load, unload)
+        self.limit = limit
+
+    def process(self, settings=None, **_):
+        from animation import Part
+
+        location_id, location = utils.get.location(self, id=True)
+
+        if not (player := utils.get.player(self, Position, id=True)):
             return
 
-        px, py = ppos.coords
+        player_id, ppos = player
+
+        if not (chunks := self.world.try_component(location_id, Chunks)):
+            size = utils.consts.CHUNK_SIZE * location.map.tilewidth
+            store = ChunkStore(self.store_path) if self.store_path else None
+            chunks = Chunks(ChunkGrid(size), store=store)
+            self.world.add_component(location_id, chunks)
+
+        grid = chunks.grid
+
+        # Части существ не хранятся в сетке: они (де)активируются вместе с
+        # существом.
+        for entity, _ in self.world.get_component(SpriteChanges):
+            if (
+                entity not in grid
+                and not self.world.has_component(entity, Part)
+                and (pos := self.world.try_component(entity, Position))
+            ):
+                grid.add(entity, pos.coords)
+                grid.crossed.add(entity)
+
+        w, h = settings["resolution"]
+        extent = w * self.load, h * self.load
+        loaded = grid.ring(ppos.coords, extent)
+        kept = grid.ring(ppos.coords, (w * self.unload, h * self.unload))
+        active = (chunks.active & kept) | loaded
+
+        if active != chunks.active:
+            for chunk in active - chunks.active:
+                if chunks.store and chunk in chunks.store:
+                    chunks.loading[chunk] = chunks.store.fetch(chunk)
+
+                chunks.queue[chunk] = None
+
+            for chunk in chunks.active - active:
+                chunks.queue[chunk] = None
+
+            chunks.active = active
+
+        # Загруженные заранее чанки, в которые игрок так и не вошёл,
+        # выгружаются обратно, когда он уходит от них за радиус выгрузки.
+        for chunk in tuple(chunks.prefetched):
+            if chunk in active or chunk not in kept:
+                chunks.prefetched.discard(chunk)
+
+            if chunk not in kept:
+                chunks.queue[chunk] = None
+
+        for entity in tuple(grid.crossed):
+            self._check(entity, player_id, chunks)
+
+        grid.crossed.clear()
+
+        self._transition(player_id, chunks)
+
+        if chunks.store:
+            self._prefetch(player_id, ppos, chunks, extent)
+            self._restore(chunks)
+
+    def _transition(self, player_id, chunks):
+        """(Де)активирует сущности чанков из очереди, пока не исчерпан лимит
+        переходов кадра. Что делать с чанком, решается в момент обработки,
+        поэтому чанк, успевший вернуться в радиус, не деактивируется."""
+
+        grid = chunks.grid
+        chunks.activated = chunks.deactivated = 0
+
+        while chunks.queue:
+            chunk = next(iter(chunks.queue))
+            activating = chunk in chunks.active
 
-        for obj, pos in world.get_component(Position):
-            if world.try_component(obj, PlayerMarker):
+            for entity in tuple(grid.chunks.get(chunk, ())):
+                if chunks.activated + chunks.deactivated >= self.limit:
+                    break
+
+                if not self.world.entity_exists(entity):
+                    grid.remove(entity)
+                elif activating:
+                    if self.world.has_component(entity, Inactive):
+                        activate(self.world, entity)
+                        chunks.activated += 1
+                elif self._check(entity, player_id, chunks):
+                    chunks.deactivated += 1
+            else:
+                del chunks.queue[chunk]
+
+                if not activating and chunks.store:
+                    self._unload(chunk, chunks)
+
+                continue
+
+            break
+
+        chunks.queued = sum(len(grid.chunks.get(chunk, ())) for chunk in chunks.queue)
+
+    def _check(self, entity, player_id, chunks) -> bool:
+        """Деактивирует сущность, если она находится вне активных чанков.
+        Возвращает True, если сущность была деактивирована."""
+
+        if entity == player_id or self.world.has_component(entity, Inactive):
+            return False
+
+        if not self.world.entity_exists(entity):
+            chunks.grid.remove(entity)
+            return False
+
+        if chunks.grid.where(entity) in chunks.active:
+            return False
+
+        deactivate(self.world, entity)
+        return True
+
+    def _group(self, entity: int) -> Dict[int, Tuple]:
+        """Собирает переносимые компоненты неактивной сущности и её частей."""
+
+        from animation import Animation
+
+        group = {}
+        stack = [entity]
+
+        while stack:
+            member = stack.pop()
+
+            if not (inactive := self.world.try_component(member, Inactive)):
+                continue
+
+            group[member] = (
+                self.world.component_for_entity(member, Position),
+                Inactive(tuple(_portable(inactive.components))),
+            )
+
+            for comp in inactive.components:
+                if isinstance(comp, Animation) and comp.children:
+                    stack.extend(comp.children)
+
+        return group
+
+    def _unload(self, chunk: Cell, chunks: Chunks):
+        """Выгружает неактивные сущности чанка в хранилище и удаляет их из
+        базы данных сущностей. Их id не переиспользуются esper, поэтому при
+        загрузке сущности получат прежние id."""
+
+        grid = chunks.grid
+        blobs = {}
+
+        for entity in tuple(grid.chunks.get(chunk, ())):
+            if not self.world.has_component(entity, Inactive):
+                continue
+
+            group = self._group(entity)
+
+            if (blob := chunks.store.dump(group)) is None:
                 continue
 
-            x, y = pos.coords
-            b1, b2 = pygame.Vector2(px - w, py - h), pygame.Vector2(px + w, py + h)
+            blobs[entity] = blob
+            grid.remove(entity)
 
-            if not (b1.x <= x <= b2.x and b1.y <= y <= b2.y):
-                self.world.create_entity(*world.components_for_entity(obj))
-                world.delete_entity(obj)
+            for member in group:
+                self.world.delete_entity(member, immediate=True)
 
+        if blobs:
+            chunks.store.save(chunk, blobs)
 
-class ChunkLoadingProcessor(esper.Processor):
-    def process(self, screen_size: Tuple[int, int], world: esper.World):
-        w, h = screen_size
+    def _prefetch(self, player_id, ppos, chunks, extent):
+        """Начинает фоновую загрузку чанков, которые войдут в радиус, если
+        игрок продолжит двигаться в том же направлении."""
 
-        ppos = utils.get.player(world, Position)
+        from movement import Velocity
 
-        if not ppos:
+        if not (vel := self.world.try_component(player_id, Velocity)):
             return
 
-        px, py = ppos.coords
+        if not vel.vector.length_squared():
+            return
+
+        grid = chunks.grid
+        ahead = ppos.coords + vel.vector.normalize() * grid.size
+
+        for chunk in grid.ring(ahead, extent) - chunks.active:
+            if chunk in chunks.store:
+                chunks.loading[chunk] = chunks.store.fetch(chunk)
+
+    def _restore(self, chunks: Chunks):
+        """Возвращает загруженные сущности в базу данных сущностей под их
+        прежними id, пока не истечёт бюджет времени кадра. Сущности чанков в
+        радиусе игрока сразу активируются."""
+
+        for chunk, future in tuple(chunks.loading.items()):
+            if not future.done():
+                continue
+
+            del chunks.loading[chunk]
+
+            try:
+                blobs = future.result()
+            except Exception:
+                logger.exception("Не удалось прочитать чанк %s", chunk)
+                chunks.store.stored.add(chunk)
+                continue
+
+            for root, blob in blobs.items():
+                chunks.arrivals.append((chunk, root, blob))
+
+        deadline = perf_counter() + self.budget / 1000
+
+        while chunks.arrivals and perf_counter() < deadline:
+            chunk, root, blob = chunks.arrivals.popleft()
+
+            try:
+                group = chunks.store.load(blob)
+            except Exception:
+                # Повреждённая группа возвращается в хранилище, а не теряется.
+                logger.exception("Не удалось загрузить сущность %s", root)
+                chunks.store.save(chunk, {root: blob})
+                continue
+
+            for entity, components in group.items():
+                for comp in components:
+                    self.world.add_component(entity, comp)
+
+            pos = self.world.component_for_entity(root, Position)
+            chunks.grid.add(root, pos.coords)
 
-        for obj, pos in self.world.get_component(Position):
-            x, y = pos.coords
-            b1, b2 = pygame.Vector2(px - w, py - h), pygame.Vector2(px + w, py + h)
-            if b1.x <= x <= b2.x and b1.y <= y <= b2.y:
-                world.create_entity(*self.world.components_for_entity(obj))
-                self.world.delete_entity(obj)
+            if (where := chunks.grid.where(root)) in chunks.active:
+                activate(self.world, root)
+            else:
+                chunks.prefetched.add(where)
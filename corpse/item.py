@@ -3,7 +3,8 @@ import esper
 import utils
 
 from copy import deepcopy
-from typing import Optional, Sequence
+from typing import Dict, Iterable, Optional, Sequence
+from dataclasses import dataclass
 from dataclasses import dataclass as component
 
 from meta import About, Id
@@ -186,6 +187,10 @@ class Gun:
     # Дальность стрельбы оружия в пикселях.
     range: float = 32 * 20
 
+    # Мгновенная стрельба: вместо пули из ствола выпускается луч длиной в
+    # дальность стрельбы, и урон наносится в кадре выстрела.
+    hitscan: bool = False
+
     _fire_rate: Optional[int] = None
 
 
@@ -198,6 +203,43 @@ class Ammo:
 ITEMS = {}
 
 
+@dataclass(frozen=True)
+class ItemRecord:
+    """Скомпилированная запись регистра предметов. Значения компонентов
+    предмета, которые нужны каждый кадр, хранятся обычными атрибутами, и их
+    не приходится искать среди компонентов. None - у предмета нет такого
+    компонента.
+
+    Параметры оружия (Gun, FireRate) у каждой сущности оружия свои, поэтому
+    они читаются из её компонентов, а не из записи."""
+
+    # Урон патрона (Damage).
+    damage: Optional[float] = None
+
+    # Изображение предмета: первый кадр его анимации.
+    icon: Optional[pygame.surface.Surface] = None
+
+
+# Записи регистра предметов по id предмета (см. init_items_registry).
+ITEM_RECORDS: Dict[str, ItemRecord] = {}
+
+
+def compile_item(id: str, comps: Iterable) -> ItemRecord:
+    """Собирает запись регистра предметов из компонентов предмета id."""
+
+    import asset
+    from creature import Damage
+    from utils.fs import ResourcePath
+
+    comps = {type(comp): comp for comp in comps}
+    damage = comps.get(Damage)
+
+    return ItemRecord(
+        damage=damage.value if damage else None,
+        icon=asset.load(ResourcePath.frame(id, idx=1)),
+    )
+
+
 def init_items_registry(world: esper.World):
     from creature import PlayerUninitialized, Damage
     from shoot import FireRate
@@ -223,7 +265,7 @@ def init_items_registry(world: esper.World):
             ),
         ),
         "machine_gun": (
-            Gun("machine_gun_ammo", 500, recoil=90),
+            Gun("machine_gun_ammo", 500, recoil=90, hitscan=True),
             FireRate(50),
             About(
                 "Миниган",
@@ -239,7 +281,7 @@ def init_items_registry(world: esper.World):
             ),
         ),
         "sniper_rifle": (
-            Gun("sniper_rifle_ammo", 5, recoil=180),
+            Gun("sniper_rifle_ammo", 5, recoil=180, hitscan=True),
             FireRate(1000),
             About(
                 "AWP",
@@ -258,3 +300,4 @@ def init_items_registry(world: esper.World):
 
     for key, val in registry.items():
         ITEMS[key] = val
+        ITEM_RECORDS[key] = compile_item(key, val)
@@ -3,11 +3,13 @@ import esper
 import pytmx
 import pyscroll
 from roof import Roof
+from tilemap import MapObject, load as load_tilemap
 import utils
 
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 from copy import deepcopy
 from enum import IntEnum, auto
+from dataclasses import field
 from dataclasses import dataclass as component
 
 
@@ -34,9 +36,17 @@ class Layer(IntEnum):
 
 @component
 class Location:
+    """Локация. objects - объекты карты по именам, если у нескольких объектов
+    одно имя, то по имени доступен первый из них. size - размер карты в
+    пикселях, bounds - левая, верхняя, правая и нижняя границы, за которые
+    нельзя заходить игроку (см. TILEMAP_BOUNDS)."""
+
     map: pytmx.TiledMap
     renderer: pyscroll.BufferedRenderer
     sprites: pyscroll.PyscrollGroup
+    objects: Dict[str, MapObject] = field(default_factory=dict)
+    size: Tuple[int, int] = (0, 0)
+    bounds: Tuple[int, int, int, int] = (0, 0, 0, 0)
 
 
 @component
@@ -62,62 +72,59 @@ class SpawnPoint:
 class InitLocationProcessor(esper.Processor):
     """Инициализирует локации."""
 
-    def _fill_object(
-        self, group: pytmx.TiledObjectGroup, object: pytmx.TiledObject, location: int
-    ):
+    def _object_comps(
+        self, object: MapObject, location: int, location_id: str
+    ) -> Optional[List]:
+        """Возвращает компоненты сущности объекта карты. Существа создаются
+        сразу (см. utils.make.creature), и для них возвращается None."""
+
+        import asset
         from movement import Direction
         from render import MakeRenderableRequest
         from object import Invisible, Size, Solid
         from utils.consts import DEFAULT_CONSUME_IMAGE
         from creature import CREATURES, CreatureNotFoundError
 
-        layer = Layer.from_str(group.name)
-        position = Position(location, pygame.Vector2(object.as_points[1]), layer)
-        size = Size(object.width, object.height)
-        image = object.image.convert_alpha() if object.image else None
+        layer = object.layer
+        position = Position(location, pygame.Vector2(object.points[1]), layer)
+        size = Size(*object.size)
 
         match layer:
             case Layer.Items | Layer.UnderObjects | Layer.Objects | Layer.Roofs:
-                entity = self.world.create_entity(
-                    position,
-                    size,
-                    MakeRenderableRequest(),
-                )
+                comps = [position, size, MakeRenderableRequest()]
 
                 if layer == Layer.Roofs:
-                    self.world.add_component(entity, Roof())
+                    comps.append(Roof())
 
                 if not object.visible:
-                    self.world.add_component(entity, Invisible())
+                    comps.append(Invisible())
 
-                if image and (
-                    consume_image := object.properties.get(
-                        "consume_image", DEFAULT_CONSUME_IMAGE
-                    )
+                consume_image = (
+                    object.properties.get("consume_image", DEFAULT_CONSUME_IMAGE)
                     or layer == Layer.Objects
-                ):
-                    image = pygame.transform.scale(image, (object.width, object.height))
-                    self.world.add_component(
-                        entity,
-                        utils.convert.animation_from_surface(image),
-                    )
+                )
+
+                # Изображение тайла общее для всех объектов с этим тайлом и
+                # размером (см. asset.resolve).
+                if object.gid and consume_image:
+                    ref = ("tile", location_id, object.gid, object.size)
+                    image = asset.resolve(ref)
+                    comps.append(utils.convert.animation_from_surface(image))
 
                 if object.rotation != 0:
-                    self.world.add_component(
-                        entity,
-                        Direction(angle=object.rotation),
-                    )
+                    comps.append(Direction(angle=object.rotation))
 
                 if not object.properties.get("soft", False) and layer == Layer.Objects:
-                    self.world.add_component(entity, Solid())
+                    comps.append(Solid())
 
                 if id := object.properties.get("item", False):
-                    for comp in utils.make.item_comps(id, own_surface=consume_image):
-                        self.world.add_component(entity, comp)
+                    comps.extend(utils.make.item_comps(id, own_surface=consume_image))
+
+                return comps
 
             case Layer.Creatures:
                 if not (id := object.properties.get("creature", None)):
-                    return
+                    return None
 
                 if id not in CREATURES:
                     raise CreatureNotFoundError(
@@ -128,9 +135,10 @@ class InitLocationProcessor(esper.Processor):
 
                 # Использовать картинку, заданную в Tiled, вместо картинки,
                 # указанной в регистре существ.
-                if image and (
+                if object.gid and (
                     object.properties.get("consume_image", DEFAULT_CONSUME_IMAGE)
                 ):
+                    image = asset.resolve(("tile", location_id, object.gid, None))
                     extra_comps.append(utils.convert.animation_from_surface(image))
 
                 utils.make.creature(
@@ -140,35 +148,62 @@ class InitLocationProcessor(esper.Processor):
                     *extra_comps,
                     *deepcopy(CREATURES[id]),
                     surface_preprocessor=lambda s: pygame.transform.rotate(s, -90),
+                    rotation_steps=utils.consts.ROTATION_ATLAS_STEPS,
                 )
 
-    def _fill_objects(self, tilemap: pytmx.TiledMap, location: int):
-        for group in tilemap.objectgroups:
-            for object in group:
-                self._fill_object(group, object, location)
+                return None
+
+    def _fill_objects(
+        self, objects: List[MapObject], location: int, location_id: str
+    ):
+        # Компоненты объекта собираются заранее, и сущность создаётся сразу со
+        # всеми ними, а не добавлением компонентов по одному.
+        for object in objects:
+            comps = self._object_comps(object, location, location_id)
+
+            if comps is not None:
+                self.world.create_entity(*comps)
 
     def _make_location(
         self, location: int, location_id: str, camera_size: Tuple[int, int]
     ):
-        tilemap = pytmx.load_pygame(utils.fs.ResourcePath.location_tilemap(location_id))
+        import asset
+        from render import LayeredGroup
 
-        self._fill_objects(tilemap, location)
+        tilemap, objects = load_tilemap(
+            utils.fs.ResourcePath.location_tilemap(location_id)
+        )
+        asset.MAPS[location_id] = tilemap
+
+        self._fill_objects(objects, location, location_id)
 
         renderer = pyscroll.BufferedRenderer(
             data=pyscroll.TiledMapData(tilemap),
             size=camera_size,
         )
 
-        sprites = pyscroll.PyscrollGroup(map_layer=renderer)
+        sprites = LayeredGroup(map_layer=renderer)
+
+        named = {}
+
+        for object in objects:
+            if object.name:
+                named.setdefault(object.name, object)
+
+        w, h = tilemap.width * tilemap.tilewidth, tilemap.height * tilemap.tileheight
+        margin = utils.consts.TILEMAP_BOUNDS
+        bounds = margin, margin, w - margin, h - margin
 
-        return Location(tilemap, renderer, sprites)
+        return Location(tilemap, renderer, sprites, named, (w, h), bounds)
 
     def process(self, location=None, settings=None, **_):
         from meta import Id
+        from spatial import SpatialIndex
 
         for entity, request in self.world.get_component(LocationInitRequest):
             location = self._make_location(entity, request.id, settings["resolution"])
             self.world.add_component(entity, location)
+            self.world.add_component(entity, SpatialIndex())
             self.world.add_component(entity, Id(request.id))
             self.world.remove_component(entity, LocationInitRequest)
 
@@ -183,21 +218,10 @@ class SpawnablePositioningProcessor(esper.Processor):
             if self.world.has_component(ent, Position):
                 continue
 
-            for group in location.map.objectgroups:
-                for object in group:
-                    object: pytmx.TiledObject
-                    if object.name == point.name:
-                        layer = Layer.from_str(group.name)
-                        break
-                    object = None
-                else:
-                    continue
-                break
-
-            if not object:
+            if not (object := location.objects.get(point.name)):
                 raise ObjectNotFoundError(f"Объект с именем {point.name} не найден")
 
-            points = object.as_points
+            points = object.points
             coords = pygame.Vector2(points[0] if len(points) == 1 else points[1])
 
-            self.world.add_component(ent, Position(location_id, coords, layer))
+            self.world.add_component(ent, Position(location_id, coords, object.layer))
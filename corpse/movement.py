@@ -14,6 +14,25 @@ class Velocity:
 class MovementProcessor(esper.Processor):
     """Перемещает каждую перемещаемую сущность на заданный вектор скорости."""
 
+    def _move(self, moving, pos, new_coords, old_coords):
+        """Применяет новые координаты и переиндексирует сущность в
+        пространственном индексе и сетке чанков локации, если она
+        действительно сдвинулась."""
+
+        from chunk import Chunks
+        from spatial import SpatialIndex
+
+        pos.coords = new_coords
+
+        if old_coords == (new_coords.x, new_coords.y):
+            return
+
+        if index := self.world.try_component(pos.location, SpatialIndex):
+            index.grid.move(moving, new_coords)
+
+        if chunks := self.world.try_component(pos.location, Chunks):
+            chunks.grid.move(moving, new_coords)
+
     def process(self, **_):
         from object import Solid
         from animation import Part
@@ -23,6 +42,12 @@ class MovementProcessor(esper.Processor):
 
         player = utils.get.player(self)
 
+        # Границы карт, вычисленные при инициализации локаций.
+        bounds = {
+            entity: location.bounds
+            for entity, location in self.world.get_component(Location)
+        }
+
         for moving, (vel, pos) in self.world.get_components(
             Velocity,
             Position,
@@ -31,20 +56,15 @@ class MovementProcessor(esper.Processor):
             if (vec.x, vec.y) == (0, 0):
                 continue
 
-            location = self.world.component_for_entity(pos.location, Location)
-            map_x, map_y = utils.get.location_map_size(location)
-
-            map_bounds = utils.consts.TILEMAP_BOUNDS
-
-            map_x -= map_bounds
-            map_y -= map_bounds
-
+            x, y = pos.coords
             new_coords = pos.coords + vec
 
             if player and moving == player:
-                if new_coords.x >= map_x or new_coords.x <= map_bounds:
+                left, top, right, bottom = bounds[pos.location]
+
+                if new_coords.x >= right or new_coords.x <= left:
                     new_coords.x = pos.coords.x
-                if new_coords.y >= map_y or new_coords.y <= map_bounds:
+                if new_coords.y >= bottom or new_coords.y <= top:
                     new_coords.y = pos.coords.y
 
             if not (
@@ -56,11 +76,10 @@ class MovementProcessor(esper.Processor):
                     ]
                 )
             ):
-                pos.coords = new_coords
+                self._move(moving, pos, new_coords, (x, y))
                 continue
 
             goback = 1
-            x, y = pos.coords
             for object, (_, object_collision, objpos) in self.world.get_components(
                 Solid, Collision, Position
             ):
@@ -84,7 +103,7 @@ class MovementProcessor(esper.Processor):
 
                     break
 
-            pos.coords = new_coords
+            self._move(moving, pos, new_coords, (x, y))
 
 
 @component
@@ -9,9 +9,14 @@ class SizeComputingProcessor(esper.Processor):
         from animation import Animation
 
         for ent, ani in self.world.get_component(Animation):
-            self.world.add_component(
-                ent, Size(*utils.convert.surface_from_animation(ani).get_size())
-            )
+            w, h = utils.convert.surface_from_animation(ani).get_size()
+
+            # Размер меняется на месте, чтобы не сбрасывать кэш запросов esper
+            # каждый кадр для каждой анимированной сущности.
+            if size := self.world.try_component(ent, Size):
+                size.w, size.h = w, h
+            else:
+                self.world.add_component(ent, Size(w, h))
 
 
 @component
@@ -30,5 +35,15 @@ class Invisible:
     pass
 
 
+@component
+class Intangible:
+    """Маркер сущности, которая не участвует в поиске столкновений спрайтов
+    (см. render.CollisionHandlingProcessor): её нет в пространственном
+    индексе локации, у неё не вычисляется маска и не появляется компонент
+    Collision. Например, пули находят цели сами (см. shoot.trace)."""
+
+    pass
+
+
 class ObjectNotFoundError(Exception):
     pass
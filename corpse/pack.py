@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import pygame
+
+from math import ceil, sqrt
+from typing import Dict, List, Optional, Tuple
+from utils.fs import RESOURCES, ResourcePath
+from utils.consts import ATLAS_PAGE_SIZE
+
+
+# Каталог со страницами атласов и файл с их индексом. Оба создаются
+# командой `python corpse/pack.py` и не хранятся в репозитории.
+ATLAS_DIR = ResourcePath.get("atlas")
+ATLAS_INDEX = os.path.join(ATLAS_DIR, "index.json")
+
+# Каталоги ресурсов, изображения из которых упаковываются в атласы.
+PACKED_DIRS = ("frames",)
+
+# Отступ между изображениями на странице атласа.
+PADDING = 1
+
+
+def _sources() -> List[str]:
+    """Возвращает пути (относительно каталога ресурсов) упаковываемых
+    изображений."""
+
+    sources = []
+
+    for dir in PACKED_DIRS:
+        for root, _, files in os.walk(ResourcePath.get(dir)):
+            for file in files:
+                if file.endswith(".png"):
+                    path = os.path.relpath(os.path.join(root, file), RESOURCES)
+                    sources.append(path.replace("\\", "/"))
+
+    return sorted(sources)
+
+
+def _width(sizes: Dict[str, Tuple[int, int]], page_size: int) -> int:
+    """Подбирает ширину страницы, при которой изображения ложатся примерно
+    в квадрат: пустые области страницы тоже приходится декодировать."""
+
+    area = sum((w + PADDING) * (h + PADDING) for w, h in sizes.values())
+    widest = max((w for w, _ in sizes.values()), default=0)
+
+    return min(page_size, max(widest, ceil(sqrt(area))))
+
+
+def _shelves(
+    sizes: Dict[str, Tuple[int, int]], width: int, page_size: int
+) -> Dict[str, Tuple[int, int, int]]:
+    """Раскладывает прямоугольники по полкам страниц атласа: изображения,
+    отсортированные по высоте, ставятся в ряд, пока ряд помещается в ширину
+    страницы. Возвращает страницу и левый верхний угол каждого изображения."""
+
+    places = {}
+    page = x = y = shelf = 0
+
+    for name in sorted(sizes, key=lambda name: (-sizes[name][1], name)):
+        w, h = sizes[name]
+
+        if w > width or h > page_size:
+            continue
+
+        if x + w > width:
+            x, y, shelf = 0, y + shelf + PADDING, 0
+
+        if y + h > page_size:
+            page, x, y, shelf = page + 1, 0, 0, 0
+
+        places[name] = page, x, y
+        x += w + PADDING
+        shelf = max(shelf, h)
+
+    return places
+
+
+def build(page_size: int = ATLAS_PAGE_SIZE) -> Dict:
+    """Упаковывает изображения ресурсов в страницы атласа, сохраняет их в
+    ATLAS_DIR вместе с индексом и возвращает индекс.
+
+    Индекс хранит для каждого изображения страницу, прямоугольник на ней и
+    время изменения исходного файла, по которому устаревшие записи
+    отбрасываются при загрузке."""
+
+    images = {name: pygame.image.load(ResourcePath.get(name)) for name in _sources()}
+    sizes = {name: image.get_size() for name, image in images.items()}
+    width = _width(sizes, page_size)
+    places = _shelves(sizes, width, page_size)
+
+    pages = [
+        pygame.Surface((width, page_size), pygame.SRCALPHA)
+        for _ in range(max((page for page, _, _ in places.values()), default=-1) + 1)
+    ]
+
+    index = {"pages": [], "images": {}}
+    bottoms = [0] * len(pages)
+
+    for name, (page, x, y) in places.items():
+        w, h = images[name].get_size()
+
+        pages[page].blit(images[name], (x, y))
+        bottoms[page] = max(bottoms[page], y + h)
+
+        index["images"][name] = {
+            "page": page,
+            "rect": [x, y, w, h],
+            "mtime": os.path.getmtime(ResourcePath.get(name)),
+        }
+
+    os.makedirs(ATLAS_DIR, exist_ok=True)
+
+    # Страницы обрезаются по самому нижнему изображению и сохраняются
+    # несжатыми: распаковка PNG страницы дольше чтения исходных файлов.
+    for i, (surface, bottom) in enumerate(zip(pages, bottoms)):
+        file = f"{i}.rgba"
+        page = surface.subsurface(0, 0, width, bottom)
+
+        with open(os.path.join(ATLAS_DIR, file), "wb") as out:
+            out.write(pygame.image.tobytes(page, "RGBA"))
+
+        index["pages"].append({"file": file, "size": [width, bottom]})
+
+    with open(ATLAS_INDEX, "w") as file:
+        json.dump(index, file, indent=1)
+
+    return index
+
+
+class PackedImages:
+    """Изображения ресурсов, упакованные в атласы командой
+    `python corpse/pack.py`. Страницы атласов загружаются при первом
+    обращении к ним, а изображения возвращаются подповерхностями страниц."""
+
+    def __init__(self, index_path: str = ATLAS_INDEX):
+        self.pages: Dict[int, pygame.surface.Surface] = {}
+        self._root = os.path.realpath(RESOURCES) + os.sep
+
+        try:
+            with open(index_path) as file:
+                self.index = json.load(file)
+        except (OSError, ValueError):
+            self.index = {"pages": [], "images": {}}
+
+    def __len__(self) -> int:
+        return len(self.index["images"])
+
+    def _page(self, page: int) -> pygame.surface.Surface:
+        if page not in self.pages:
+            info = self.index["pages"][page]
+
+            with open(os.path.join(ATLAS_DIR, info["file"]), "rb") as file:
+                pixels = file.read()
+
+            surface = pygame.image.frombytes(pixels, info["size"], "RGBA")
+            self.pages[page] = surface.convert_alpha()
+
+        return self.pages[page]
+
+    def get(self, path: str) -> Optional[pygame.surface.Surface]:
+        """Возвращает изображение из атласа по абсолютному пути к исходному
+        файлу (без символических ссылок) или None, если изображение не
+        упаковано или исходный файл изменился после упаковки."""
+
+        if not path.startswith(self._root):
+            return None
+
+        name = path[len(self._root) :].replace(os.sep, "/")
+
+        if not (entry := self.index["images"].get(name)):
+            return None
+
+        try:
+            if os.path.getmtime(path) != entry["mtime"]:
+                return None
+        except OSError:
+            return None
+
+        return self._page(entry["page"]).subsurface(entry["rect"])
+
+
+_PACKED: Optional[PackedImages] = None
+
+
+def packed(path: str) -> Optional[pygame.surface.Surface]:
+    """Возвращает упакованное изображение (см. PackedImages.get)."""
+
+    global _PACKED
+
+    if _PACKED is None:
+        _PACKED = PackedImages()
+
+    return _PACKED.get(path)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+
+    index = build(int(sys.argv[1]) if len(sys.argv) > 1 else ATLAS_PAGE_SIZE)
+
+    print(
+        f"Упаковано изображений: {len(index['images'])}, "
+        f"страниц: {len(index['pages'])} ({ATLAS_DIR})"
+    )
@@ -0,0 +1,282 @@
+import esper
+import utils
+import pygame
+import transform
+
+from typing import Dict, Tuple
+from dataclasses import dataclass as component
+
+# NumPy - необязательная зависимость (`poetry install -E projectiles`). Без неё
+# ProjectileProcessor ничего не делает, и пули остаются сущностями (см.
+# shoot.ShootingProcessor).
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Массивы Projectiles: форма строки и тип элементов.
+_ARRAYS = {
+    "coords": ((2,), "float64"),
+    "velocity": ((2,), "float64"),
+    "start": ((2,), "float64"),
+    "range": ((), "float64"),
+    # Урон целочисленный, как у патронов в регистре предметов, чтобы
+    # попадания пуль-сущностей и пуль из массивов меняли Health одинаково.
+    "damage": ((), "int64"),
+    "owner": ((), "int64"),
+    "turn": ((), "int32"),
+}
+
+
+@component
+class Projectiles:
+    """Пули локации, которые хранятся не сущностями, а строками массивов
+    NumPy. Перемещение пуль и проверка дальности выполняются для всех пуль
+    локации одной векторной операцией за кадр.
+
+    Параметры компонента:
+    coords: координаты пуль
+    velocity: векторы скорости пуль
+    start: координаты, из которых пули выпущены
+    range: дальность стрельбы оружия, из которого выпущена пуля
+    damage: урон пуль
+    owner: сущности, выпустившие пули
+    turn: индексы поворотов изображения пули (см. ROTATION_STEP)
+    count: количество живых пуль, они занимают первые count строк массивов."""
+
+    coords: "np.ndarray" = None
+    velocity: "np.ndarray" = None
+    start: "np.ndarray" = None
+    range: "np.ndarray" = None
+    damage: "np.ndarray" = None
+    owner: "np.ndarray" = None
+    turn: "np.ndarray" = None
+    count: int = 0
+
+    def __post_init__(self):
+        if self.coords is None:
+            self._resize(utils.consts.PROJECTILE_CAPACITY)
+
+    def _resize(self, capacity: int):
+        """Переносит живые пули в массивы вместимостью capacity."""
+
+        n = self.count
+
+        for name, (shape, dtype) in _ARRAYS.items():
+            array = np.zeros((capacity, *shape), dtype)
+
+            if (old := getattr(self, name)) is not None:
+                array[:n] = old[:n]
+
+            setattr(self, name, array)
+
+    def add(
+        self,
+        coords: Tuple[float, float],
+        angle: float,
+        owner: int,
+        range: float,
+        damage: int,
+        speed: float = utils.consts.BULLET_SPEED,
+    ):
+        """Добавляет пулю, летящую под углом angle. Если массивы заполнены, их
+        вместимость удваивается."""
+
+        if self.count == len(self.coords):
+            self._resize(len(self.coords) * 2)
+
+        i = self.count
+        steps = round(360 / utils.consts.ROTATION_STEP)
+
+        self.coords[i] = self.start[i] = coords
+        self.velocity[i] = utils.math.angle_vector(angle) * speed
+        self.range[i] = range
+        self.damage[i] = damage
+        self.owner[i] = owner
+        self.turn[i] = round(transform.quantize(-angle) / 360 * steps) % steps
+        self.count += 1
+
+    def keep(self, alive: "np.ndarray"):
+        """Оставляет только пули, отмеченные в alive, сохраняя их порядок."""
+
+        n = self.count
+        k = int(alive.sum())
+
+        for name in _ARRAYS:
+            array = getattr(self, name)
+            array[:k] = array[:n][alive]
+
+        self.count = k
+
+
+def _occupied(world: esper.World, grid) -> "np.ndarray":
+    """Возвращает ключи (см. _keys) ячеек сетки, в которых есть сущности,
+    способные остановить пулю или получить от неё урон."""
+
+    from creature import Health
+    from object import Solid
+
+    cells = set()
+
+    for comp in (Health, Solid):
+        for entity, _ in world.get_component(comp):
+            if entity in grid:
+                cells |= grid.covered(grid.rect(entity))
+
+    if not cells:
+        return np.empty(0, np.int64)
+
+    return _keys(np.array(list(cells), np.int64))
+
+
+def _keys(cells: "np.ndarray") -> "np.ndarray":
+    # Ячейка (x, y) кодируется одним числом, чтобы искать ячейки через np.isin.
+    return (cells[..., 0] << 32) + (cells[..., 1] & 0xFFFFFFFF)
+
+
+class ProjectileProcessor(esper.Processor):
+    """Перемещает пули, хранящиеся в Projectiles, и наносит урон тем, в кого
+    они попали.
+
+    Отрезки, которые пули пролетают за кадр, сначала отбираются векторно:
+    дальше проверяются только отрезки, задевающие ячейки пространственного
+    индекса с твёрдыми сущностями или сущностями со здоровьем. Для них
+    столкновения ищутся одной пачкой лучей (см. shoot.trace), поэтому пуля,
+    как и пуля-сущность, останавливается на первой твёрдой сущности."""
+
+    def __init__(self):
+        # Ключи занятых ячеек по локациям и версия индекса, для
+        # которой они посчитаны (см. SpatialHash.version).
+        self._occupied: Dict[int, Tuple[int, "np.ndarray"]] = {}
+
+    def process(self, **_):
+        from shoot import trace
+        from creature import DamageRequest, Health
+        from object import Solid
+        from spatial import SpatialIndex
+
+        if np is None:
+            return
+
+        location_id = utils.get.location(self, id=True)[0]
+
+        if not self.world.has_component(location_id, Projectiles):
+            self.world.add_component(location_id, Projectiles())
+
+        for location, projectiles in self.world.get_component(Projectiles):
+            if not (n := projectiles.count):
+                continue
+
+            coords = projectiles.coords[:n]
+            ends = coords + projectiles.velocity[:n]
+            flown = ((ends - projectiles.start[:n]) ** 2).sum(axis=1)
+            alive = flown <= projectiles.range[:n] ** 2
+
+            if index := self.world.try_component(location, SpatialIndex):
+                grid = index.grid
+
+                # Ячейки начала и конца отрезка. Отрезок длиной меньше ячейки
+                # задевает не больше четырёх ячеек в углах их прямоугольника.
+                first = np.floor(coords / grid.cell_size).astype(np.int64)
+                last = np.floor(ends / grid.cell_size).astype(np.int64)
+                low, high = np.minimum(first, last), np.maximum(first, last)
+                corners = np.stack(
+                    (
+                        low,
+                        high,
+                        np.stack((low[:, 0], high[:, 1]), axis=1),
+                        np.stack((high[:, 0], low[:, 1]), axis=1),
+                    ),
+                    axis=1,
+                )
+
+                version, occupied = self._occupied.get(location, (None, None))
+
+                if version != grid.version:
+                    occupied = _occupied(self.world, grid)
+                    self._occupied[location] = grid.version, occupied
+
+                near = np.isin(_keys(corners), occupied).any(axis=1)
+                long = ((high - low) > 1).any(axis=1)
+
+                candidates = np.flatnonzero(alive & (near | long))
+                owners = projectiles.owner[candidates].tolist()
+                damages = projectiles.damage[candidates].tolist()
+                rays = [
+                    (pygame.Vector2(start), pygame.Vector2(end), (owner,))
+                    for start, end, owner in zip(
+                        coords[candidates].tolist(), ends[candidates].tolist(), owners
+                    )
+                ]
+                traced = trace(self.world, grid, rays)
+
+                for i, owner, damage, hits in zip(candidates, owners, damages, traced):
+                    for _, target in hits:
+                        if self.world.has_component(target, Health):
+                            self.world.create_entity(
+                                DamageRequest(owner, target, damage)
+                            )
+
+                        if self.world.has_component(target, Solid):
+                            alive[i] = False
+                            break
+
+            coords[:] = ends
+            projectiles.keep(alive)
+
+
+class ProjectileDrawingProcessor(esper.Processor):
+    """Передаёт пули текущей локации, хранящиеся в Projectiles, на отрисовку
+    вместе со спрайтами на слое существ (см. render.LayeredGroup), поэтому
+    должен выполняться до SpriteDrawingProcessor. Изображения пуль повёрнуты
+    с шагом ROTATION_STEP и общие для всех пуль с одним углом."""
+
+    def __init__(self, margin: int = utils.consts.VIEW_MARGIN):
+        self.margin = margin
+        self._images: Dict[int, pygame.surface.Surface] = {}
+
+    def _image(self, turn: int) -> pygame.surface.Surface:
+        """Возвращает изображение пули с индексом поворота turn."""
+
+        import asset
+        from utils.fs import ResourcePath
+
+        if turn not in self._images:
+            frame = asset.load(ResourcePath.frame("bullet", idx=1))
+            angle = turn * 360 / round(360 / utils.consts.ROTATION_STEP)
+            self._images[turn] = transform.rotated(frame, angle)[0]
+
+        return self._images[turn]
+
+    def process(self, **_):
+        from location import Layer
+
+        if np is None:
+            return
+
+        location_id, location = utils.get.location(self, id=True)
+
+        if not (projectiles := self.world.try_component(location_id, Projectiles)):
+            return
+
+        n = projectiles.count
+        coords = projectiles.coords[:n]
+        view = location.renderer.view_rect.inflate(self.margin * 2, self.margin * 2)
+
+        visible = np.flatnonzero(
+            (coords[:, 0] >= view.left)
+            & (coords[:, 0] < view.right)
+            & (coords[:, 1] >= view.top)
+            & (coords[:, 1] < view.bottom)
+        )
+
+        # Прямоугольники в координатах карты, как у спрайтов: в координаты
+        # экрана их переводит группа отрисовки с учётом масштаба.
+        for center, turn in zip(
+            coords[visible].tolist(), projectiles.turn[visible].tolist()
+        ):
+            image = self._image(turn)
+            location.sprites.extra.append(
+                (image, image.get_rect(center=center), Layer.Creatures.value)
+            )
@@ -1,8 +1,13 @@
 import pygame
 import esper
 import utils
+import pyscroll
+import transform
 
-from typing import List
+from enum import IntFlag, auto
+from dataclasses import field
+from typing import List, Optional, Set, Tuple
+from spatial import SpatialIndex, bounds
 from dataclasses import dataclass as component
 
 
@@ -21,12 +26,84 @@ class Sprite:
     original_image: pygame.surface.Surface
     sprite: pygame.sprite.Sprite
 
+    # Исходный кадр и квантованный угол, из которых получено текущее
+    # изображение спрайта. None, если изображение уникально для спрайта.
+    _source: Optional[Tuple[pygame.surface.Surface, float]] = None
+
+    # Входные данные отрисовки, какими их видел SpriteChangeTrackingProcessor
+    # в прошлый раз.
+    _frame: Optional[pygame.surface.Surface] = None
+    _angle: Optional[float] = None
+    _size: Optional[Tuple[float, float]] = None
+    _place: Optional[Tuple[float, float, int]] = None
+
+    # Изменения, отложенные до момента, когда спрайт попадёт в поле зрения.
+    _pending: int = 0
+
 
 @component
 class SpriteImageChangedMarker:
     pass
 
 
+class Change(IntFlag):
+    """Входные данные отрисовки спрайта, которые могут измениться между кадрами."""
+
+    Frame = auto()
+    Angle = auto()
+    Size = auto()
+    Position = auto()
+
+
+ALL_CHANGES = Change.Frame | Change.Angle | Change.Size | Change.Position
+
+
+@component
+class SpriteChanges:
+    """Грязные биты спрайта: какие входные данные отрисовки изменились с
+    прошлого кадра. Этапы отрисовки обрабатывают только сущности с этим
+    компонентом."""
+
+    value: Change
+
+
+@component
+class DynamicSprite:
+    """Маркер спрайта, входные данные отрисовки которого могут меняться после
+    создания: сущность двигается, является частью тела или анимирована.
+    Остальные спрайты перерисовываются, только если им явно выставить
+    SpriteChanges (см. mark_changed)."""
+
+    pass
+
+
+@component
+class SpriteHiddenMarker:
+    """Маркер спрайта, изображение которого скрыто InvisibilityApplyingProcessor."""
+
+    pass
+
+
+@component
+class Viewport:
+    """Спрайты локации, попавшие в поле зрения камеры в текущем кадре, и
+    счётчики отрисованных и отсечённых спрайтов."""
+
+    visible: Set[int] = field(default_factory=set)
+    drawn: int = 0
+    culled: int = 0
+
+
+def mark_changed(world: esper.World, entity: int, changes: Change = ALL_CHANGES):
+    """Помечает входные данные спрайта изменёнными, чтобы этапы отрисовки
+    обработали его в текущем кадре."""
+
+    if comp := world.try_component(entity, SpriteChanges):
+        comp.value |= changes
+    else:
+        world.add_component(entity, SpriteChanges(changes))
+
+
 @component
 class Collision:
     entities: List[int]
@@ -34,9 +111,10 @@ class Collision:
 
 class SpriteMakingProcessor(esper.Processor):
     def process(self, **_):
-        from object import Size
+        from object import Intangible, Size
         from location import Position
-        from animation import Animation
+        from movement import Velocity
+        from animation import Animation, Part, States
 
         for entity, (_, ani, pos) in self.world.get_components(
             MakeRenderableRequest, Animation, Position
@@ -55,14 +133,160 @@ class SpriteMakingProcessor(esper.Processor):
             self.world.add_component(entity, SpriteImageChangedMarker())
             self.world.remove_component(entity, MakeRenderableRequest)
 
+            mark_changed(self.world, entity)
+
+            if not self.world.has_component(entity, Intangible) and (
+                index := self.world.try_component(pos.location, SpatialIndex)
+            ):
+                index.grid.insert(entity, bounds(render, pos.coords))
+
+            if (
+                len(ani.frames) > 1
+                or ani.state_based_frames
+                or any(
+                    self.world.has_component(entity, comp)
+                    for comp in (Velocity, Part, States)
+                )
+            ):
+                self.world.add_component(entity, DynamicSprite())
+
+
+class SpriteChangeTrackingProcessor(esper.Processor):
+    """Выставляет грязные биты динамическим спрайтам, у которых с прошлого
+    кадра изменился кадр анимации, угол, размер или позиция. Стоимость
+    отрисовки поэтому зависит от количества движущихся и анимированных
+    сущностей, а не от общего количества спрайтов."""
+
+    def process(self, **_):
+        from object import Invisible, Size
+        from location import Position
+        from movement import Direction
+        from animation import Animation
+
+        for entity, (_, render, ani, pos) in self.world.get_components(
+            DynamicSprite, Sprite, Animation, Position
+        ):
+            changes = Change(0)
+
+            frame = utils.convert.surface_from_animation(ani)
+            if frame is not render._frame:
+                render._frame = frame
+                changes |= Change.Frame
+
+            dir = self.world.try_component(entity, Direction)
+            angle = transform.quantize(-dir.angle) if dir else None
+            if angle != render._angle:
+                render._angle = angle
+                changes |= Change.Angle
+
+            size = self.world.try_component(entity, Size)
+            size = (size.w, size.h) if size else None
+            if size != render._size:
+                render._size = size
+                changes |= Change.Size
+
+            place = (pos.coords.x, pos.coords.y, pos.layer)
+            if place != render._place:
+                render._place = place
+                changes |= Change.Position
+
+            if changes:
+                mark_changed(self.world, entity, changes)
+
+        # Скрытые спрайты перерисовываются, как только их снова нужно показать.
+        for entity, _ in self.world.get_components(SpriteHiddenMarker, Sprite):
+            if not self.world.has_component(entity, Invisible):
+                self.world.remove_component(entity, SpriteHiddenMarker)
+                mark_changed(self.world, entity)
+
+
+class SpriteCullingProcessor(esper.Processor):
+    """Отсекает спрайты за пределами поля зрения камеры (с запасом margin
+    пикселей). Отсечённые спрайты не попадают в группу отрисовки, а
+    поворот, масштабирование и пересчёт маски для них откладываются, пока
+    спрайт снова не окажется в поле зрения. Прямоугольники отсечённых
+    спрайтов по-прежнему обновляются: по ним ищутся столкновения."""
+
+    def __init__(self, margin: int = utils.consts.VIEW_MARGIN):
+        self.margin = margin
+
+    def process(self, **_):
+        from object import Intangible
+        from location import Position
+
+        location_id, location = utils.get.location(self, id=True)
+
+        if not (index := self.world.try_component(location_id, SpatialIndex)):
+            return
+
+        if not (viewport := self.world.try_component(location_id, Viewport)):
+            viewport = Viewport()
+            self.world.add_component(location_id, viewport)
+
+        grid = index.grid
+        view = location.renderer.view_rect.inflate(self.margin * 2, self.margin * 2)
+
+        visible = {
+            entity
+            for entity in grid.query(view)
+            if grid.rect(entity).colliderect(view)
+            and self.world.entity_exists(entity)
+            and self.world.has_component(entity, Sprite)
+        }
+
+        # Неосязаемых сущностей нет в пространственном индексе (см.
+        # object.Intangible), их прямоугольники проверяются по одному.
+        intangible = self.world.get_components(Intangible, Sprite)
+        visible.update(
+            entity
+            for entity, (_, render) in intangible
+            if render.sprite.rect.colliderect(view)
+        )
+
+        for entity in viewport.visible - visible:
+            if self.world.entity_exists(entity) and (
+                render := self.world.try_component(entity, Sprite)
+            ):
+                location.sprites.remove(render.sprite)
+
+        for entity in visible - viewport.visible:
+            render = self.world.component_for_entity(entity, Sprite)
+
+            if pos := self.world.try_component(entity, Position):
+                location.sprites.add(render.sprite, layer=pos.layer.value)
+
+            if render._pending:
+                mark_changed(self.world, entity, Change(render._pending))
+                render._pending = 0
+
+        deferred = Change.Frame | Change.Angle | Change.Size
+
+        for entity, (changes, render) in self.world.get_components(
+            SpriteChanges, Sprite
+        ):
+            if entity in visible or not changes.value & deferred:
+                continue
+
+            render._pending |= changes.value & deferred
+            changes.value &= ~deferred
+
+        viewport.visible = visible
+        viewport.drawn = len(visible)
+        viewport.culled = len(grid) + len(intangible) - len(visible)
+
 
 class SpriteAnimationSyncingProcessor(esper.Processor):
     def process(self, **_):
         from animation import Animation
 
-        for entity, (ani, render) in self.world.get_components(Animation, Sprite):
+        for entity, (changes, ani, render) in self.world.get_components(
+            SpriteChanges, Animation, Sprite
+        ):
+            if not changes.value & Change.Frame:
+                continue
+
             render.original_image = utils.convert.surface_from_animation(ani)
-            self.world.add_component(entity, SpriteImageChangedMarker)
+            self.world.add_component(entity, SpriteImageChangedMarker())
 
 
 class SpriteSortingProcessor(esper.Processor):
@@ -71,15 +295,24 @@ class SpriteSortingProcessor(esper.Processor):
 
         location = utils.get.location(self)
 
-        for _, (render, pos) in self.world.get_components(Sprite, Position):
-            if render.sprite not in location.sprites:
-                location.sprites.add(render.sprite, layer=pos.layer.value)
+        for _, (changes, render, pos) in self.world.get_components(
+            SpriteChanges, Sprite, Position
+        ):
+            # В группу отрисовки спрайты добавляет SpriteCullingProcessor.
+            if (
+                not changes.value & Change.Position
+                or render.sprite not in location.sprites
+            ):
+                continue
+
             if location.sprites.get_layer_of_sprite(render.sprite) != pos.layer.value:
                 location.sprites.change_layer(render.sprite, pos.layer.value)
 
 
 class SpriteRemovingProcessor(esper.Processor):
     def process(self, **_):
+        from chunk import Chunks
+
         location = utils.get.location(self)
 
         for entity, _ in self.world.get_component(MakeUnrenderableRequest):
@@ -88,20 +321,39 @@ class SpriteRemovingProcessor(esper.Processor):
 
             location.sprites.remove(render.sprite)
             self.world.remove_component(entity, Sprite)
+
+            for _, index in self.world.get_component(SpatialIndex):
+                index.grid.remove(entity)
+
+            for _, chunks in self.world.get_component(Chunks):
+                chunks.grid.remove(entity)
+
             self.world.remove_component(entity, MakeUnrenderableRequest)
 
 
 class SizeApplyingProcessor(esper.Processor):
     def process(self, **_):
         from object import Size
+        from movement import Direction
 
-        for entity, (render, size) in self.world.get_components(Sprite, Size):
-            if render.sprite.image.get_size() == (size.w, size.h):
+        for entity, (changes, render, size) in self.world.get_components(
+            SpriteChanges, Sprite, Size
+        ):
+            if not changes.value & (Change.Frame | Change.Size):
                 continue
 
-            render.sprite.image = pygame.transform.scale(
-                render.original_image, (size.w, size.h)
-            )
+            # Изображение направленных спрайтов целиком строит
+            # DirectionApplyingProcessor.
+            if self.world.has_component(entity, Direction):
+                continue
+
+            if render.original_image.get_size() == (size.w, size.h):
+                render.sprite.image = render.original_image
+            else:
+                render.sprite.image = pygame.transform.scale(
+                    render.original_image, (size.w, size.h)
+                )
+            render._source = (render.original_image, 0.0)
 
             self.world.add_component(entity, SpriteImageChangedMarker())
 
@@ -110,10 +362,20 @@ class DirectionApplyingProcessor(esper.Processor):
     def process(self, **_):
         from movement import Direction, SetDirectionRequest, SetDirectionRequestApprove
 
-        for _, (dir, render) in self.world.get_components(Direction, Sprite):
-            render.sprite.image = pygame.transform.rotate(
-                render.original_image, -dir.angle
-            )
+        for _, (changes, dir, render) in self.world.get_components(
+            SpriteChanges, Direction, Sprite
+        ):
+            if not changes.value & (Change.Frame | Change.Angle):
+                continue
+
+            rotation = (render.original_image, transform.quantize(-dir.angle))
+
+            # Ни кадр, ни угол не изменились - изображение уже повёрнуто.
+            if render._source == rotation:
+                continue
+
+            render.sprite.image, render.sprite.mask = transform.rotated(*rotation)
+            render._source = rotation
 
         for entity, (render, _) in self.world.get_components(
             Sprite, SetDirectionRequest
@@ -124,22 +386,78 @@ class DirectionApplyingProcessor(esper.Processor):
 
 class SpriteMaskComputingProcessor(esper.Processor):
     def process(self, **_):
-        for _, (_, render) in self.world.get_components(
+        from object import Intangible
+
+        for entity, (_, render) in self.world.get_components(
             SpriteImageChangedMarker, Sprite
         ):
-            render.sprite.mask = pygame.mask.from_surface(render.sprite.image)
+            if self.world.has_component(entity, Intangible):
+                continue
+
+            source, angle = render._source or (None, 0.0)
+            render.sprite.mask = transform.mask(render.sprite.image, source, angle)
 
 
 class CollisionHandlingProcessor(esper.Processor):
+    """Находит столкновения спрайтов. Кандидаты на столкновение берутся из
+    пространственного индекса локации, поэтому маски сравниваются только у
+    спрайтов, прямоугольники которых пересекаются.
+
+    Сущности без скорости (Velocity) считаются статичными: пары из двух
+    статичных сущностей не проверяются, а статичная сущность получает
+    компонент Collision, только если её коснулась динамическая. Сущности с
+    маркером Intangible не проверяются вовсе."""
+
     def process(self, **_):
-        for entity1, render1 in self.world.get_component(Sprite):
-            collides = []
-            for entity2, render2 in self.world.get_component(Sprite):
-                if entity1 == entity2:
+        from object import Intangible
+        from location import Position
+        from movement import Velocity
+
+        dynamic = [
+            (entity, comps)
+            for entity, comps in self.world.get_components(Sprite, Position, Velocity)
+            if not self.world.has_component(entity, Intangible)
+        ]
+        collisions = {entity: [] for entity, _ in dynamic}
+
+        for entity1, (render1, pos1, _) in dynamic:
+            if not (index := self.world.try_component(pos1.location, SpatialIndex)):
+                continue
+
+            grid = index.grid
+            sprite1 = render1.sprite
+
+            for entity2 in grid.query(sprite1.rect):
+                if entity2 == entity1:
                     continue
-                if pygame.sprite.collide_mask(render1.sprite, render2.sprite):
-                    collides.append(entity2)
-            self.world.add_component(entity1, Collision(collides))
+
+                if entity2 in collisions and self.world.has_component(
+                    entity2, Velocity
+                ):
+                    # Пара динамических сущностей проверяется только один раз.
+                    if entity2 < entity1:
+                        continue
+                elif not self.world.entity_exists(
+                    entity2
+                ) or not self.world.has_component(entity2, Sprite):
+                    # Сущность удалили из мира, не убрав её из индекса.
+                    grid.remove(entity2)
+                    continue
+                elif not self.world.has_component(
+                    entity2, Position
+                ) or self.world.has_component(entity2, Intangible):
+                    continue
+
+                sprite2 = self.world.component_for_entity(entity2, Sprite).sprite
+
+                if sprite1.rect.colliderect(
+                    sprite2.rect
+                ) and pygame.sprite.collide_mask(sprite1, sprite2):
+                    collisions[entity1].append(entity2)
+                    collisions.setdefault(entity2, []).append(entity1)
+
+        for entity, collides in collisions.items():
+            self.world.add_component(entity, Collision(collides))
 
 
 class CollisionRemovingProcessor(esper.Processor):
@@ -150,11 +468,34 @@ class CollisionRemovingProcessor(esper.Processor):
 
 class SpriteRectUpdatingProcessor(esper.Processor):
     def process(self, **_):
+        from object import Intangible
         from location import Position
 
-        for _, (render, pos) in self.world.get_components(Sprite, Position):
+        for entity, (_, render, pos) in self.world.get_components(
+            SpriteChanges, Sprite, Position
+        ):
             render.sprite.rect = render.sprite.image.get_rect(center=pos.coords)
 
+            if self.world.has_component(entity, Intangible) or not (
+                index := self.world.try_component(pos.location, SpatialIndex)
+            ):
+                continue
+
+            # Новые спрайты попадают в индекс здесь. Сущности, перемещённые в
+            # обход MovementProcessor (например, привязанные части тела),
+            # здесь же переиндексируются.
+            grid = index.grid
+            if entity not in grid or not grid.rect(entity).contains(
+                render.sprite.rect
+            ):
+                grid.update(entity, bounds(render, pos.coords))
+
+
+class SpriteChangesRemovingProcessor(esper.Processor):
+    def process(self, **_):
+        for entity, _ in self.world.get_component(SpriteChanges):
+            self.world.remove_component(entity, SpriteChanges)
+
 
 class SpriteImageChangedMarkerRemovingProcessor(esper.Processor):
     def process(self, **_):
@@ -166,8 +507,51 @@ class InvisibilityApplyingProcessor(esper.Processor):
     def process(self, **_):
         from object import Invisible
 
-        for _, (_, render) in self.world.get_components(Invisible, Sprite):
+        for entity, (_, render) in self.world.get_components(Invisible, Sprite):
+            if render.sprite.image.get_alpha() == 0:
+                continue
+
+            # Изображение может быть общим для нескольких спрайтов, поэтому
+            # прозрачность задаётся копии.
+            render.sprite.image = render.sprite.image.copy()
             render.sprite.image.set_alpha(0)
+            render._source = None
+
+            if not self.world.has_component(entity, SpriteHiddenMarker):
+                self.world.add_component(entity, SpriteHiddenMarker())
+
+
+class LayeredGroup(pyscroll.PyscrollGroup):
+    """Группа отрисовки спрайтов локации. Кроме спрайтов группа рисует
+    изображения из extra - кортежи (изображение, прямоугольник в координатах
+    карты, слой), добавленные за кадр (см. projectile.ProjectileDrawingProcessor).
+    Они рисуются в одном проходе со спрайтами, поэтому их, как и спрайты,
+    перекрывают тайлы и спрайты верхних слоёв, и они масштабируются вместе
+    с картой. После отрисовки extra очищается."""
+
+    def __init__(self, map_layer: pyscroll.BufferedRenderer, *args, **kwargs):
+        super().__init__(map_layer, *args, **kwargs)
+        self.extra: List[Tuple[pygame.surface.Surface, pygame.Rect, int]] = []
+
+    def draw(self, surface: pygame.surface.Surface) -> pygame.Rect:
+        ox, oy = self._map_layer.get_center_offset()
+        area = surface.get_rect()
+        surfaces = []
+
+        for spr in self.sprites():
+            rect = spr.rect.move(ox, oy)
+
+            if rect.colliderect(area):
+                surfaces.append((spr.image, rect, self.get_layer_of_sprite(spr)))
+                self.spritedict[spr] = rect
+
+        for image, rect, layer in self.extra:
+            surfaces.append((image, rect.move(ox, oy), layer))
+
+        self.extra.clear()
+        self.lostsprites = []
+
+        return self._map_layer.draw(surface, area, surfaces)
 
 
 class SpriteDrawingProcessor(esper.Processor):
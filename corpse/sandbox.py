@@ -24,7 +24,8 @@ from object import SizeComputingProcessor
 from effect import ScreenReddingProcessor
 from chrono import DayNightCyclingProcessor
 from ui import UiDrawingProcessor, UiMakingProcessor
-from chunk import ChunkUnloadingProcessor, ChunkLoadingProcessor
+from chunk import ChunkActivatingProcessor
+from projectile import ProjectileDrawingProcessor, ProjectileProcessor
 
 
 PROCESSORS = (
@@ -37,6 +38,9 @@ PROCESSORS = (
     #
     # Rendering Sprites / Applying Transformations
     SpriteMakingProcessor,
+    SpriteChangeTrackingProcessor,
+    ChunkActivatingProcessor,
+    SpriteCullingProcessor,
     SpriteAnimationSyncingProcessor,
     SpriteSortingProcessor,
     SizeApplyingProcessor,
@@ -45,10 +49,12 @@ PROCESSORS = (
     SpriteRectUpdatingProcessor,
     SpriteMaskComputingProcessor,
     CollisionHandlingProcessor,
+    ProjectileDrawingProcessor,
     SpriteDrawingProcessor,
     #
     # Shooting
     ShootingProcessor,
+    ProjectileProcessor,
     ShotDelayingProcessor,
     #
     # Movement / Deformations
@@ -106,14 +112,10 @@ PROCESSORS = (
     RemoveItemCollidingMarker,
     ShotMarkerRemovingProcessor,
     SpriteImageChangedMarkerRemovingProcessor,
+    SpriteChangesRemovingProcessor,
     CollisionRemovingProcessor,
 )
 
-CHUNK_LOADER_PROCESSORS = (
-    ChunkUnloadingProcessor,
-    ChunkLoadingProcessor,
-)
-
 MENU_MANAGER_PROCESSORS = (
     MenuCreationProcessor,
     MenuTogglingProcessor,
@@ -137,6 +139,7 @@ def fill_world(world: esper.World):
         surface_preprocessor=lambda s: pygame.transform.rotate(
             pygame.transform.scale2x(s), 90
         ),
+        rotation_steps=utils.consts.ROTATION_ATLAS_STEPS,
     )
 
 
@@ -164,11 +167,6 @@ if __name__ == "__main__":
     for processor in PROCESSORS:
         world.add_processor(processor())
 
-    chunkloader = esper.World()
-
-    for processor in CHUNK_LOADER_PROCESSORS:
-        chunkloader.add_processor(processor())
-
     menumanager = esper.World()
     for processor in MENU_MANAGER_PROCESSORS:
         menumanager.add_processor(processor())
@@ -206,7 +204,6 @@ if __name__ == "__main__":
             uimanager=uimanager,
             uistorage=uistorage,
         )
-        chunkloader.process(settings["resolution"], world)
 
         pygame.display.flip()
 
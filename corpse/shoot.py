@@ -3,9 +3,12 @@ import utils
 import pygame
 
 from item import FireRate
-from render import MakeRenderableRequest, MakeUnrenderableRequest
+from spatial import SpatialHash
+from render import ALL_CHANGES, MakeRenderableRequest, SpriteChanges
 from ai import Cmd, Command, FollowInstructions
 
+from typing import Collection, Dict, List, Optional, Sequence, Set, Tuple
+from dataclasses import field
 from dataclasses import dataclass as component
 
 
@@ -20,6 +23,71 @@ class Bullet:
     gun: int
     start_coords: pygame.Vector2
 
+    # Дальность стрельбы оружия, из которого выпущена пуля (Gun.range).
+    range: float
+
+
+@component
+class ParkedBullet:
+    """Маркер пули, ожидающей выстрела в пуле (см. BulletPool)."""
+
+    pass
+
+
+@component
+class BulletPool:
+    """Пул сущностей пуль локации. Попавшая в цель или улетевшая слишком
+    далеко пуля не удаляется, а паркуется: с сущности снимаются только
+    позиция, спрайт и скорость (см. ShootingProcessor._park), поэтому
+    выстрел и парковка сбрасывают кэш запросов бд сущностей всего несколько
+    раз. Часть пуль создаётся заранее (см. BULLET_POOL_SIZE), а если
+    свободных пуль не хватает, пул растёт.
+
+    Летящую пулю могут деактивировать или выгрузить на диск чанки (см.
+    chunk.ChunkActivatingProcessor). Выгруженная пуля удаляется из бд
+    сущностей и выбывает из пула (см. reconcile), а загруженная обратно
+    снова попадает в пул, когда её паркуют.
+
+    Параметры компонента:
+    parked: снятые спрайты и скорости припаркованных пуль
+    flying: выпущенные из пула и ещё не припаркованные пули
+    fired: количество выпущенных из пула пуль."""
+
+    parked: Dict[int, Tuple] = field(default_factory=dict)
+    flying: Set[int] = field(default_factory=set)
+    fired: int = 0
+
+    def reconcile(self, world: esper.World):
+        """Убирает из пула пули, удалённые из бд сущностей."""
+
+        self.flying = {b for b in self.flying if world.entity_exists(b)}
+
+        for bullet in [b for b in self.parked if not world.entity_exists(b)]:
+            del self.parked[bullet]
+
+    def stats(self, world: esper.World) -> Dict[str, int]:
+        from chunk import Inactive
+
+        self.reconcile(world)
+        inactive = sum(world.has_component(b, Inactive) for b in self.flying)
+
+        return {
+            "size": len(self.parked) + len(self.flying),
+            "parked": len(self.parked),
+            "active": len(self.flying) - inactive,
+            "inactive": inactive,
+            "fired": self.fired,
+        }
+
+
+def stats(world: esper.World) -> Dict[int, Dict[str, int]]:
+    """Статистика пулов пуль по локациям для профилирования."""
+
+    return {
+        location: pool.stats(world)
+        for location, pool in world.get_component(BulletPool)
+    }
+
 
 @component
 class ShotMarker:
@@ -31,6 +99,104 @@ class ShotLock:
     pass
 
 
+def _mask_entry(
+    sprite: pygame.sprite.Sprite, start: pygame.Vector2, end: pygame.Vector2
+) -> Optional[float]:
+    """Возвращает расстояние от start до первого непрозрачного пикселя маски
+    спрайта на отрезке от start до end или None, если отрезок маску не
+    задевает."""
+
+    if not (clipped := sprite.rect.clipline(start, end)):
+        return None
+
+    (x1, y1), (x2, y2) = clipped
+
+    if not (mask := getattr(sprite, "mask", None)):
+        return start.distance_to((x1, y1))
+
+    left, top = sprite.rect.topleft
+    w, h = mask.get_size()
+    steps = max(abs(x2 - x1), abs(y2 - y1), 1)
+
+    for i in range(steps + 1):
+        x, y = x1 + (x2 - x1) * i / steps, y1 + (y2 - y1) * i / steps
+        px, py = round(x) - left, round(y) - top
+
+        if 0 <= px < w and 0 <= py < h and mask.get_at((px, py)):
+            return start.distance_to((x, y))
+
+    return None
+
+
+# Луч: начало и конец отрезка и сущности, которые луч не задевает.
+Ray = Tuple[pygame.Vector2, pygame.Vector2, Collection[int]]
+
+
+def _target(
+    world: esper.World, entity: int
+) -> Tuple[bool, Optional[pygame.sprite.Sprite]]:
+    """Возвращает, может ли луч задеть сущность, и спрайт, по маске которого
+    уточняется касание."""
+
+    from render import Sprite
+    from creature import Health
+    from object import Intangible, Solid
+
+    if (
+        not world.entity_exists(entity)
+        or world.has_component(entity, Intangible)
+        or not (
+            world.has_component(entity, Health) or world.has_component(entity, Solid)
+        )
+    ):
+        return False, None
+
+    render = world.try_component(entity, Sprite)
+
+    return True, render.sprite if render else None
+
+
+def trace(
+    world: esper.World, grid: SpatialHash, rays: Sequence[Ray]
+) -> List[List[Tuple[float, int]]]:
+    """Возвращает для каждого луча сущности со здоровьем (Health) или твёрдые
+    (Solid), которых он касается, вместе с расстоянием от начала луча до
+    точки касания, в порядке возрастания расстояния.
+
+    Кандидаты берутся из пространственного индекса по прямоугольникам, а
+    касание уточняется по маскам спрайтов. Сущности из ignore луча и
+    сущности с маркером Intangible пропускаются. Лучи проверяются пачкой:
+    компоненты каждого кандидата смотрятся один раз на все лучи."""
+
+    targets = {}
+    traced = []
+
+    for start, end, ignore in rays:
+        hits = []
+
+        for distance, entity in grid.cast(start, end):
+            if entity in ignore:
+                continue
+
+            if (target := targets.get(entity)) is None:
+                target = targets[entity] = _target(world, entity)
+
+            hittable, sprite = target
+
+            if not hittable:
+                continue
+
+            if sprite and (distance := _mask_entry(sprite, start, end)) is None:
+                continue
+
+            hits.append((distance, entity))
+
+        hits.sort()
+        traced.append(hits)
+
+    return traced
+
+
 class ShotDelayingProcessor(esper.Processor):
     def process(self, dt=None, **_):
         for ent, (blocker, _) in self.world.get_components(FireRate, ShotLock):
@@ -48,17 +214,23 @@ class ShotDelayingProcessor(esper.Processor):
 class ShootingProcessor(esper.Processor):
     def process(self, **_):
         from location import Layer
-        from item import Gun, ITEMS
+        from item import Gun, ITEM_RECORDS
         from creature import Health
-        from render import Collision
         from movement import Velocity
         from location import Position
         from movement import Direction
+        from spatial import SpatialIndex
         from object import Size, Solid
-        from animation import Animation
-        from utils.fs import ResourcePath
+        from projectile import Projectiles
         from creature import Damage, DamageRequest
 
+        for _, pool in self.world.get_component(BulletPool):
+            pool.reconcile(self.world)
+
+        # Лучи выстрелов по локациям: луч, стрелявший, урон и пуля (None для
+        # мгновенных выстрелов). Все лучи кадра проверяются одной пачкой.
+        shots: Dict[int, List[Tuple[Ray, int, float, Optional[int]]]] = {}
+
         for ent, (_, pos, dir, size) in self.world.get_components(
             ShootRequest,
             Position,
@@ -80,28 +252,26 @@ class ShootingProcessor(esper.Processor):
             if self.world.has_component(equips, FireRate):
                 self.world.add_component(equips, ShotLock())
 
-            damage = next(filter(lambda c: type(c) is Damage, ITEMS[gun.ammo_id])).value
+            damage = ITEM_RECORDS[gun.ammo_id].damage
 
             coords = pygame.Vector2(
                 pos.coords.copy() + pygame.Vector2(size.w // 3, 0).rotate(dir.angle),
             )
 
-            self.world.create_entity(
-                Bullet(ent, equips, coords.copy()),
-                Direction(dir.angle),
-                Position(
-                    pos.location,
-                    coords,
-                    Layer.Creatures,
-                ),
-                Velocity(
-                    utils.math.angle_vector(dir.angle) * utils.consts.BULLET_SPEED
-                ),
-                Animation((pygame.image.load(ResourcePath.frame("bullet", idx=1)),)),
-                MakeRenderableRequest(),
-                Damage(damage),
-                Solid(),
-            )
+            if gun.hitscan:
+                end = coords + utils.math.angle_vector(dir.angle) * gun.range
+                shots.setdefault(pos.location, []).append(
+                    ((coords, end, (ent,)), ent, damage, None)
+                )
+            elif projectiles := self.world.try_component(pos.location, Projectiles):
+                projectiles.add(coords, dir.angle, ent, gun.range, damage)
+            else:
+                self._fire(
+                    Bullet(ent, equips, coords.copy(), gun.range),
+                    Position(pos.location, coords, Layer.Creatures),
+                    dir.angle,
+                    damage,
+                )
 
             self.world.add_component(
                 ent, FollowInstructions((Command(Cmd.Rotate, gun.recoil),))
@@ -109,23 +279,170 @@ class ShootingProcessor(esper.Processor):
 
             self.world.add_component(ent, ShotMarker())
 
-        for ent, (bullet, damage, pos, collision) in self.world.get_components(
-            Bullet, Damage, Position, Collision
+        # Пули не ищут столкновения по маскам: за кадр пуля пролетает
+        # отрезок длиной в свою скорость, и задевает то, что лежит на нём.
+        # Поэтому быстрые пули не пролетают цели насквозь.
+        for ent, (bullet, damage, pos, vel) in self.world.get_components(
+            Bullet, Damage, Position, Velocity
         ):
-            for collides in collision.entities:
-                if self.world.has_component(collides, Health):
-                    self.world.create_entity(
-                        DamageRequest(bullet.owner, collides, damage.value)
-                    )
-
-                if (
-                    self.world.has_component(collides, Solid)
-                    or bullet.start_coords.distance_to(pos.coords)
-                    > self.world.component_for_entity(bullet.gun, Gun).range
-                ):
-                    self.world.add_component(ent, MakeUnrenderableRequest())
-                    self.world.delete_entity(ent)
-                    break
+            end = pos.coords + vel.vector
+
+            if bullet.start_coords.distance_to(end) <= bullet.range:
+                ray = pos.coords, end, (bullet.owner,)
+                shots.setdefault(pos.location, []).append(
+                    (ray, bullet.owner, damage.value, ent)
+                )
+            else:
+                self._park(ent, pos.location)
+
+        for location, group in shots.items():
+            if not (index := self.world.try_component(location, SpatialIndex)):
+                continue
+
+            rays = [ray for ray, *_ in group]
+
+            for (_, owner, damage, bullet), hits in zip(
+                group, trace(self.world, index.grid, rays)
+            ):
+                for _, target in hits:
+                    if self.world.has_component(target, Health):
+                        self.world.create_entity(DamageRequest(owner, target, damage))
+
+                    if self.world.has_component(target, Solid):
+                        if bullet is not None:
+                            self._park(bullet, location)
+                        break
+
+    def _pool(self, location: int) -> BulletPool:
+        """Возвращает пул пуль локации, создавая его при первом выстреле."""
+
+        if pool := self.world.try_component(location, BulletPool):
+            return pool
+
+        pool = BulletPool()
+        self.world.add_component(location, pool)
+        self._grow(pool, utils.consts.BULLET_POOL_SIZE)
+
+        return pool
+
+    def _grow(self, pool: BulletPool, count: int):
+        import asset
+        from movement import Direction, Velocity
+        from object import Intangible
+        from animation import Animation
+        from creature import Damage
+        from utils.fs import ResourcePath
+
+        frame = asset.load(ResourcePath.frame("bullet", idx=1))
+
+        for _ in range(count):
+            entity = self.world.create_entity(
+                ParkedBullet(),
+                Direction(0),
+                Animation((frame,)),
+                Damage(0),
+                Intangible(),
+            )
+            pool.parked[entity] = (Velocity(pygame.Vector2()),)
+
+    def _fire(self, bullet: Bullet, position, angle: float, damage: float):
+        """Выпускает пулю из пула локации: возвращает пуле позицию, спрайт и
+        скорость. Пуля, которая уже выпускалась, сохраняет свой спрайт, и её
+        изображение только перерисовывается."""
+
+        from render import Sprite
+        from creature import Damage
+        from movement import Direction, Velocity
+
+        pool = self._pool(position.location)
+
+        while True:
+            if not pool.parked:
+                self._grow(pool, 1)
+
+            entity, parked = pool.parked.popitem()
+
+            if self.world.entity_exists(entity):
+                break
+
+        comps = {type(comp): comp for comp in parked}
+        velocity = comps.get(Velocity) or Velocity(pygame.Vector2())
+        velocity.vector = utils.math.angle_vector(angle) * utils.consts.BULLET_SPEED
+
+        # Направление и урон остаются на сущности и меняются на месте, без
+        # сброса кэша запросов бд сущностей.
+        if direction := self.world.try_component(entity, Direction):
+            direction.angle = angle
+        else:
+            self.world.add_component(entity, Direction(angle))
+
+        if dmg := self.world.try_component(entity, Damage):
+            dmg.value = damage
+        else:
+            self.world.add_component(entity, Damage(damage))
+
+        # Прямоугольник спрайта переносится сразу, чтобы отсечение в
+        # следующем кадре не смотрело на место, где пуля была припаркована.
+        if render := comps.get(Sprite):
+            render.sprite.rect.center = position.coords
+            self.world.add_component(entity, render)
+            self.world.add_component(entity, SpriteChanges(ALL_CHANGES))
+        else:
+            self.world.add_component(entity, MakeRenderableRequest())
+
+        self.world.add_component(entity, bullet)
+        self.world.add_component(entity, position)
+        self.world.add_component(entity, velocity)
+        self.world.remove_component(entity, ParkedBullet)
+
+        pool.flying.add(entity)
+        pool.fired += 1
+
+    def _park(self, bullet: int, location: int):
+        """Возвращает пулю в пул локации. С пули снимаются позиция, спрайт и
+        скорость, поэтому её не видят процессоры движения, отрисовки и
+        стрельбы. Спрайт и скорость хранятся в пуле до следующего выстрела,
+        а остальные компоненты остаются на сущности."""
+
+        from chunk import Chunks
+        from spatial import SpatialIndex
+        from render import Sprite
+        from movement import Velocity
+        from location import Location, Position
+
+        if render := self.world.try_component(bullet, Sprite):
+            self.world.component_for_entity(location, Location).sprites.remove(
+                render.sprite
+            )
+
+        # Пули неосязаемы и обычно не попадают в пространственный индекс, но
+        # припаркованная пуля не должна остаться ни в одной из сеток.
+        for _, index in self.world.get_component(SpatialIndex):
+            index.grid.remove(bullet)
+
+        for _, chunks in self.world.get_component(Chunks):
+            chunks.grid.remove(bullet)
+
+        # Компоненты удалённой сущности, в том числе помеченной на удаление в
+        # следующем кадре, трогать нельзя: esper сотрёт их сам.
+        if not self.world.entity_exists(bullet):
+            return
+
+        self.world.add_component(bullet, ParkedBullet())
+        parked = []
+
+        for type_ in (Position, Sprite, Velocity):
+            if (comp := self.world.try_component(bullet, type_)) is not None:
+                self.world.remove_component(bullet, type_)
+
+                if type_ is not Position:
+                    parked.append(comp)
+
+        # Пуля, загруженная из хранилища чанков или созданная не пулом,
+        # попадает в пул здесь.
+        pool = self._pool(location)
+        pool.flying.discard(bullet)
+        pool.parked[bullet] = tuple(parked)
 
 
 class ShotMarkerRemovingProcessor(esper.Processor):
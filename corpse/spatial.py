@@ -0,0 +1,222 @@
+import pygame
+
+from math import ceil, floor, hypot
+from typing import Dict, Iterator, List, Set, Tuple
+from dataclasses import field
+from dataclasses import dataclass as component
+
+from utils.consts import SPATIAL_CELL_SIZE
+
+
+Cell = Tuple[int, int]
+
+
+class SpatialHash:
+    """Равномерная сетка для быстрого поиска сущностей по прямоугольнику.
+
+    Каждая сущность хранится в тех ячейках сетки, которые пересекает её
+    прямоугольник. Запрос по прямоугольнику возвращает сущности из всех
+    затронутых им ячеек, поэтому точную проверку (например, по маскам)
+    нужно делать только для найденных кандидатов.
+
+    Параметры:
+    cell_size: размер стороны ячейки в пикселях.
+
+    version увеличивается при каждом изменении ячеек сетки, поэтому по нему
+    можно понять, устарели ли посчитанные по ячейкам данные."""
+
+    def __init__(self, cell_size: int = SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells: Dict[Cell, Set[int]] = {}
+        self.version = 0
+        self._rects: Dict[int, pygame.Rect] = {}
+
+    def __len__(self) -> int:
+        return len(self._rects)
+
+    def __contains__(self, entity: int) -> bool:
+        return entity in self._rects
+
+    def _span(self, rect: pygame.Rect) -> Tuple[int, int, int, int]:
+        """Возвращает границы (включительно) ячеек, покрываемых прямоугольником."""
+
+        size = self.cell_size
+        return (
+            floor(rect.left / size),
+            floor(rect.top / size),
+            floor((rect.right - 1) / size) if rect.w else floor(rect.left / size),
+            floor((rect.bottom - 1) / size) if rect.h else floor(rect.top / size),
+        )
+
+    def _cells(self, rect: pygame.Rect) -> Iterator[Cell]:
+        x1, y1, x2, y2 = self._span(rect)
+        for x in range(x1, x2 + 1):
+            for y in range(y1, y2 + 1):
+                yield x, y
+
+    def cell(self, point: Tuple[float, float]) -> Cell:
+        """Возвращает ячейку, в которую попадает точка."""
+
+        x, y = point
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+    def covered(self, rect: pygame.Rect) -> Set[Cell]:
+        """Возвращает множество ячеек, которые пересекает прямоугольник."""
+
+        return set(self._cells(rect))
+
+    def insert(self, entity: int, rect: pygame.Rect):
+        """Добавляет сущность в сетку. Если сущность уже есть в сетке, то
+        её прямоугольник будет обновлён."""
+
+        if entity in self._rects:
+            return self.update(entity, rect)
+
+        self._rects[entity] = pygame.Rect(rect)
+        self.version += 1
+
+        for cell in self._cells(rect):
+            self.cells.setdefault(cell, set()).add(entity)
+
+    def remove(self, entity: int):
+        """Удаляет сущность из сетки. Отсутствие сущности не является ошибкой."""
+
+        if (rect := self._rects.pop(entity, None)) is None:
+            return
+
+        self.version += 1
+
+        for cell in self._cells(rect):
+            if (bucket := self.cells.get(cell)) is None:
+                continue
+            bucket.discard(entity)
+            if not bucket:
+                del self.cells[cell]
+
+    def update(self, entity: int, rect: pygame.Rect):
+        """Обновляет прямоугольник сущности. Ячейки перестраиваются, только
+        если набор покрываемых ячеек изменился."""
+
+        if (old := self._rects.get(entity)) is None:
+            return self.insert(entity, rect)
+
+        if self._span(old) != self._span(rect):
+            self.remove(entity)
+            return self.insert(entity, rect)
+
+        old.update(rect)
+
+    def move(self, entity: int, center: Tuple[float, float]):
+        """Перемещает прямоугольник сущности, сохраняя его размер."""
+
+        if (old := self._rects.get(entity)) is None:
+            return
+
+        rect = old.copy()
+        rect.center = center
+        self.update(entity, rect)
+
+    def rect(self, entity: int) -> pygame.Rect:
+        return self._rects[entity]
+
+    def query(self, rect: pygame.Rect) -> Set[int]:
+        """Возвращает сущности из всех ячеек, которые пересекает прямоугольник."""
+
+        found = set()
+        cells = self.cells
+
+        for cell in self._cells(rect):
+            if bucket := cells.get(cell):
+                found |= bucket
+
+        return found
+
+    def traverse(
+        self, start: Tuple[float, float], end: Tuple[float, float]
+    ) -> Iterator[Cell]:
+        """Перебирает ячейки, через которые проходит отрезок, в порядке от
+        start к end (алгоритм Amanatides-Woo). В отличие от запроса по
+        описанному вокруг отрезка прямоугольнику, количество ячеек растёт
+        линейно с длиной отрезка."""
+
+        size = self.cell_size
+        (x, y), (ex, ey) = self.cell(start), self.cell(end)
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        step_x, step_y = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+
+        # Доля отрезка до пересечения следующей границы ячейки по каждой оси и
+        # доля отрезка, за которую пересекается целая ячейка.
+        inf = float("inf")
+        next_x = ((x + (step_x > 0)) * size - start[0]) / dx if dx else inf
+        next_y = ((y + (step_y > 0)) * size - start[1]) / dy if dy else inf
+        delta_x = size / abs(dx) if dx else inf
+        delta_y = size / abs(dy) if dy else inf
+
+        yield x, y
+
+        for _ in range(abs(ex - x) + abs(ey - y)):
+            if next_x < next_y:
+                x += step_x
+                next_x += delta_x
+            else:
+                y += step_y
+                next_y += delta_y
+
+            yield x, y
+
+    def cast(
+        self, start: Tuple[float, float], end: Tuple[float, float]
+    ) -> List[Tuple[float, int]]:
+        """Возвращает сущности, прямоугольники которых пересекает отрезок от
+        start до end, вместе с расстоянием от start до точки входа в
+        прямоугольник, в порядке возрастания расстояния."""
+
+        hits = []
+        seen = set()
+        cells = self.cells
+        sx, sy = start
+
+        for cell in self.traverse(start, end):
+            if not (bucket := cells.get(cell)):
+                continue
+
+            for entity in bucket - seen:
+                seen.add(entity)
+
+                if clipped := self._rects[entity].clipline(start, end):
+                    (x, y), _ = clipped
+                    hits.append((hypot(x - sx, y - sy), entity))
+
+        hits.sort()
+
+        return hits
+
+    def clear(self):
+        self.cells.clear()
+        self._rects.clear()
+        self.version += 1
+
+
+@component
+class SpatialIndex:
+    """Постоянный пространственный индекс спрайтов локации. Хранится на
+    сущности локации и обновляется только для тех сущностей, которые
+    переместились, поэтому неподвижные объекты карты попадают в индекс
+    один раз при загрузке."""
+
+    grid: SpatialHash = field(default_factory=SpatialHash)
+
+
+def bounds(render, coords) -> pygame.Rect:
+    """Возвращает квадрат с центром в coords, в который помещается спрайт при
+    любом угле поворота. Такой прямоугольник не нужно обновлять при вращении
+    сущности."""
+
+    w, h = render.original_image.get_size()
+    iw, ih = render.sprite.image.get_size()
+    side = ceil(hypot(max(w, iw), max(h, ih)))
+
+    rect = pygame.Rect(0, 0, side, side)
+    rect.center = coords
+
+    return rect
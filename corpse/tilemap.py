@@ -0,0 +1,234 @@
+import os
+import pickle
+import pytmx
+import hashlib
+
+from xml.etree import ElementTree
+from dataclasses import dataclass
+from pytmx.util_pygame import pygame_image_loader
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+# location импортирует этот модуль, поэтому Layer нужен только для аннотаций.
+if TYPE_CHECKING:
+    from location import Layer
+
+
+# Скомпилированная карта хранится рядом с .tmx файлом в файле с таким
+# суффиксом. При изменении формата файла нужно увеличить версию.
+CACHE_SUFFIX = ".cache"
+CACHE_VERSION = 1
+
+# Ссылка на изображение тайла: путь к файлу, цветовой ключ, прямоугольник
+# тайла в файле и флаги отражения тайла.
+ImageRef = Tuple[str, Optional[str], Optional[Tuple[int, int, int, int]], Any]
+
+
+@dataclass
+class MapObject:
+    """Объект карты Tiled, свойства которого уже разобраны."""
+
+    name: Optional[str]
+    layer: "Layer"
+    points: Tuple[Tuple[float, float], ...]
+    size: Tuple[float, float]
+    rotation: float
+    visible: bool
+    gid: int
+    properties: Dict[str, Any]
+
+
+def _ref_loader(filename: str, colorkey: Optional[str], **_):
+    """Загрузчик изображений для pytmx, который вместо изображений тайлов
+    возвращает ссылки на них (см. ImageRef)."""
+
+    return lambda rect=None, flags=None: (filename, colorkey, rect, flags)
+
+
+def _restore_element(element: pytmx.TiledElement, state: Dict[str, Any]):
+    # __getattr__ элементов pytmx обращается к self.properties, поэтому
+    # состояние восстанавливается в обход стандартного протокола pickle.
+    element.__dict__.update(state)
+
+
+class _Pickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if isinstance(obj, pytmx.TiledElement):
+            cls = type(obj)
+            items = iter(obj) if isinstance(obj, list) else None
+            return cls.__new__, (cls,), obj.__dict__, items, None, _restore_element
+        return NotImplemented
+
+
+def _fingerprint(path: str) -> Tuple[float, str]:
+    with open(path, "rb") as file:
+        return os.path.getmtime(path), hashlib.sha1(file.read()).hexdigest()
+
+
+def _fresh(
+    deps: Dict[str, Tuple[float, str]]
+) -> Optional[Dict[str, Tuple[float, str]]]:
+    """Проверяет, что файлы, из которых скомпилирована карта, не изменились:
+    сначала по времени изменения, а если оно другое - по содержимому.
+    Возвращает зависимости с актуальным временем изменения или None, если
+    содержимое какого-то файла изменилось."""
+
+    fresh = {}
+
+    for path, (mtime, digest) in deps.items():
+        try:
+            if os.path.getmtime(path) == mtime:
+                fresh[path] = mtime, digest
+            elif (fingerprint := _fingerprint(path))[1] == digest:
+                fresh[path] = fingerprint
+            else:
+                return None
+        except OSError:
+            return None
+
+    return fresh
+
+
+def _used_gids(tilemap: pytmx.TiledMap, objects: List[MapObject]) -> List[int]:
+    """Возвращает идентификаторы тайлов, которые встречаются на карте: в
+    слоях тайлов, в объектах и в анимациях этих тайлов."""
+
+    gids = {object.gid for object in objects if object.gid}
+
+    for layer in tilemap.layers:
+        if isinstance(layer, pytmx.TiledTileLayer):
+            gids.update(gid for row in layer.data for gid in row if gid)
+        elif isinstance(layer, pytmx.TiledImageLayer) and layer.gid:
+            gids.add(layer.gid)
+
+    for gid in list(gids):
+        for frame in (tilemap.tile_properties.get(gid) or {}).get("frames", ()):
+            gids.add(frame.gid)
+
+    return sorted(gids)
+
+
+def build(path: str) -> Dict[str, Any]:
+    """Разбирает .tmx файл и возвращает скомпилированную карту: карту pytmx
+    без изображений, объекты карты и ссылки на изображения используемых
+    тайлов."""
+
+    from location import Layer
+
+    tilemap = pytmx.TiledMap(path, image_loader=_ref_loader)
+    objects = [
+        MapObject(
+            object.name,
+            Layer.from_str(group.name),
+            tuple(tuple(point) for point in object.as_points),
+            (object.width, object.height),
+            object.rotation,
+            bool(object.visible),
+            object.gid,
+            dict(object.properties),
+        )
+        for group in tilemap.objectgroups
+        for object in group
+    ]
+    refs = {gid: tilemap.images[gid] for gid in _used_gids(tilemap, objects)}
+    tilemap.images = [None] * len(tilemap.images)
+
+    root = ElementTree.parse(path).getroot()
+    deps = [path] + [
+        os.path.join(os.path.dirname(path), tileset.get("source"))
+        for tileset in root.iter("tileset")
+        if tileset.get("source")
+    ]
+
+    return {
+        "deps": {dep: _fingerprint(dep) for dep in deps},
+        "map": tilemap,
+        "objects": objects,
+        "refs": refs,
+    }
+
+
+def _read(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as file:
+            header = pickle.load(file)
+
+            if header != (CACHE_VERSION, pytmx.__version__):
+                return None
+
+            deps = pickle.load(file)
+
+            if (fresh := _fresh(deps)) is None:
+                return None
+
+            compiled = pickle.load(file)
+    except Exception:
+        # Повреждённый или несовместимый кэш - не ошибка: карта просто
+        # разбирается заново.
+        return None
+
+    compiled["deps"] = fresh
+
+    # Если у файлов изменилось только время изменения, кэш переписывается
+    # с новым временем, иначе их содержимое хешировалось бы при каждой
+    # загрузке.
+    if fresh != deps:
+        _write(path, compiled)
+
+    return compiled
+
+
+def _write(path: str, compiled: Dict[str, Any]):
+    temp = f"{path}.tmp"
+
+    try:
+        with open(temp, "wb") as file:
+            pickle.dump((CACHE_VERSION, pytmx.__version__), file)
+            pickle.dump(compiled["deps"], file)
+
+            body = {key: value for key, value in compiled.items() if key != "deps"}
+            _Pickler(file, pickle.HIGHEST_PROTOCOL).dump(body)
+
+        os.replace(temp, path)
+    except Exception:
+        # Кэш - только ускорение загрузки: если карту не удалось сохранить
+        # (например, у неё есть свойство, которое нельзя сериализовать),
+        # она просто будет разобрана заново в следующий раз.
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+
+def _load_images(tilemap: pytmx.TiledMap, refs: Dict[int, ImageRef]):
+    """Загружает изображения тайлов по ссылкам. Файл, из которого нарезано
+    несколько тайлов, читается один раз."""
+
+    loaders = {}
+
+    for gid, (filename, colorkey, rect, flags) in refs.items():
+        if (filename, colorkey) not in loaders:
+            loaders[filename, colorkey] = pygame_image_loader(filename, colorkey)
+
+        tilemap.images[gid] = loaders[filename, colorkey](rect, flags)
+
+    tilemap.image_loader = pygame_image_loader
+
+
+def load(path: str) -> Tuple[pytmx.TiledMap, List[MapObject]]:
+    """Загружает карту Tiled и её объекты.
+
+    Разобранная карта сохраняется рядом с .tmx файлом, и пока ни он, ни
+    файлы его наборов тайлов не изменились, при следующих загрузках XML не
+    разбирается. Загружаются только изображения тайлов, которые встречаются
+    на карте."""
+
+    cache = path + CACHE_SUFFIX
+
+    if (compiled := _read(cache)) is None:
+        compiled = build(path)
+        _write(cache, compiled)
+
+    tilemap = compiled["map"]
+    _load_images(tilemap, compiled["refs"])
+
+    return tilemap, compiled["objects"]
@@ -0,0 +1,115 @@
+import pygame
+
+from utils.cache import LRUCache
+from typing import Dict, Optional, Tuple
+from utils.consts import MASK_CACHE_SIZE, ROTATION_CACHE_SIZE, ROTATION_STEP
+
+
+# Повёрнутые поверхности и их маски. Ключ - исходная поверхность и угол
+# поворота, поэтому спрайты с одинаковыми кадрами делят одни и те же
+# повёрнутые изображения.
+ROTATIONS = LRUCache(ROTATION_CACHE_SIZE)
+
+# Маски изображений спрайтов. Ключ - исходный кадр, угол поворота и размер
+# изображения, поэтому одинаковые изображения разных спрайтов делят одну маску.
+MASKS = LRUCache(MASK_CACHE_SIZE)
+
+# Атласы заранее повёрнутых кадров по идентификатору существа.
+ATLASES: Dict[str, "RotationAtlas"] = {}
+
+# Все запечённые кадры всех атласов: кадр -> повороты с равным шагом.
+_BAKED: Dict[pygame.surface.Surface, Tuple] = {}
+
+# Маски запечённых повёрнутых изображений.
+_MASKS: Dict[pygame.surface.Surface, pygame.mask.Mask] = {}
+
+
+def quantize(angle: float, step: float = ROTATION_STEP) -> float:
+    """Округляет угол до ближайшего кратного step и приводит его к [0, 360)."""
+    return round(angle / step) * step % 360
+
+
+def rotated(
+    surface: pygame.surface.Surface, angle: float
+) -> Tuple[pygame.surface.Surface, pygame.mask.Mask]:
+    """Возвращает повёрнутую на angle градусов (против часовой стрелки)
+    поверхность и её маску. Возвращаемая поверхность общая для всех
+    вызывающих, поэтому изменять её нельзя."""
+
+    if (baked := _BAKED.get(surface)) is not None:
+        return baked[round(angle * len(baked) / 360) % len(baked)]
+
+    return ROTATIONS.get_or_make((surface, angle), lambda: _rotate(surface, angle))
+
+
+def mask(
+    image: pygame.surface.Surface,
+    source: Optional[pygame.surface.Surface] = None,
+    angle: float = 0.0,
+) -> pygame.mask.Mask:
+    """Возвращает маску изображения image, полученного из кадра source
+    поворотом на angle градусов и масштабированием до собственного размера.
+    Если происхождение изображения неизвестно (source не указан), маска
+    вычисляется без кэширования."""
+
+    if (baked := _MASKS.get(image)) is not None:
+        MASKS.hits += 1
+        return baked
+
+    if source is None:
+        MASKS.misses += 1
+        return pygame.mask.from_surface(image)
+
+    return MASKS.get_or_make(
+        (source, angle, image.get_size()), lambda: pygame.mask.from_surface(image)
+    )
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Статистика кэшей преобразований для профилирования."""
+
+    return {"rotations": ROTATIONS.stats(), "masks": MASKS.stats()}
+
+
+def _rotate(surface: pygame.surface.Surface, angle: float):
+    image = pygame.transform.rotate(surface, angle)
+    return image, mask(image, surface, angle)
+
+
+class RotationAtlas:
+    """Атлас заранее повёрнутых кадров одного существа. Каждый кадр при
+    запекании поворачивается на steps углов с равным шагом, а маски
+    повёрнутых изображений вычисляются сразу, поэтому во время игры поворот
+    кадра сводится к поиску в словаре.
+
+    Кадры существ загружаются и запекаются один раз (см.
+    animation.creature_frames) и общие для всех экземпляров существа."""
+
+    def __init__(self, steps: int):
+        self.steps = steps
+
+    def bake(self, frame: pygame.surface.Surface):
+        if frame in _BAKED:
+            return
+
+        step = 360 / self.steps
+        rotations = tuple(
+            (image, pygame.mask.from_surface(image))
+            for image in (
+                pygame.transform.rotate(frame, i * step) for i in range(self.steps)
+            )
+        )
+
+        _BAKED[frame] = rotations
+        for image, image_mask in rotations:
+            _MASKS[image] = image_mask
+
+
+def atlas(id: str, steps: int) -> RotationAtlas:
+    """Возвращает атлас существа с идентификатором id, создавая его при
+    необходимости."""
+
+    if id not in ATLASES:
+        ATLASES[id] = RotationAtlas(steps)
+
+    return ATLASES[id]
@@ -1 +1 @@
-from . import consts, convert, fs, get, make, math
+from . import cache, consts, convert, fs, get, make, math
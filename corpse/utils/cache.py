@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш, вытесняющий давно не использованные
+    значения. Считает попадания и промахи для профилирования.
+
+    Параметры:
+    maxsize: максимальное количество хранимых значений (None - без ограничений)
+    maxweight: максимальный суммарный вес хранимых значений (None - без
+    ограничений)
+    weigh: функция, возвращающая вес значения (например, размер в байтах)."""
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        maxweight: Optional[int] = None,
+        weigh: Callable[[Any], int] = lambda _: 1,
+    ):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._weights: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self.weight -= self._weights.get(key, 0)
+        self._weights[key] = weight = self.weigh(value)
+        self.weight += weight
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+
+        # Последнее добавленное значение не вытесняется, даже если оно одно
+        # тяжелее maxweight.
+        while len(self._data) > 1 and (
+            (self.maxsize is not None and len(self._data) > self.maxsize)
+            or (self.maxweight is not None and self.weight > self.maxweight)
+        ):
+            evicted, _ = self._data.popitem(last=False)
+            self.weight -= self._weights.pop(evicted)
+
+    def get_or_make(self, key: Hashable, make: Callable[[], Any]) -> Any:
+        """Возвращает значение по ключу, вычисляя и запоминая его при промахе."""
+
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            value = make()
+            self.put(key, value)
+            return value
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self._weights.clear()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "weight": self.weight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -11,9 +11,58 @@ FPS = 60
 DEFAULT_SPEED = 3
 BULLET_SPEED = 10
 
+# Сколько сущностей пуль создаётся в пуле локации заранее (см. shoot.BulletPool).
+BULLET_POOL_SIZE = 32
+
+# Начальная вместимость массивов пуль локации (см. projectile.Projectiles).
+PROJECTILE_CAPACITY = 1024
+
 # За сколько пикселей до подхода к границам карты запрещать проходить дальше.
 TILEMAP_BOUNDS = 32
 
+# Размер ячейки сетки, используемой для поиска столкновений, в пикселях.
+SPATIAL_CELL_SIZE = 64
+
+# Размер стороны чанка в тайлах карты.
+CHUNK_SIZE = 8
+
+# Радиусы (в размерах экрана от игрока), войдя в который чанк активируется
+# и покинув который деактивируется, а также максимальное количество
+# сущностей, (де)активируемых за кадр.
+CHUNK_LOAD_DISTANCE = 1.0
+CHUNK_UNLOAD_DISTANCE = 1.5
+CHUNK_TRANSITIONS_PER_FRAME = 64
+
+# Каталог, в который выгружаются далёкие чанки. None - неактивные сущности
+# остаются в памяти.
+CHUNK_STORE_PATH = None
+
+# Сколько миллисекунд за кадр можно тратить на добавление загруженных из
+# хранилища чанков сущностей в базу данных сущностей.
+CHUNK_INSERT_BUDGET = 2
+
+# Запас в пикселях вокруг поля зрения камеры, в пределах которого спрайты
+# не отсекаются.
+VIEW_MARGIN = 64
+
+# Шаг (в градусах), с которым квантуются углы поворота спрайтов, и
+# максимальное количество повёрнутых изображений в кэше.
+ROTATION_STEP = 1.0
+ROTATION_CACHE_SIZE = 4096
+
+# Максимальное количество масок в кэше масок спрайтов.
+MASK_CACHE_SIZE = 4096
+
+# Максимальный суммарный размер (в байтах) изображений в кэше ассетов.
+ASSET_CACHE_BYTES = 64 * 1024 * 1024
+
+# Размер стороны страницы атласа, в который упаковываются изображения
+# ресурсов (см. pack.py).
+ATLAS_PAGE_SIZE = 2048
+
+# Количество углов, на которые заранее поворачиваются кадры существ.
+ROTATION_ATLAS_STEPS = 64
+
 MAX_ZOOM = 5.0
 MIN_ZOOM = 1.0
 ZOOM_STEP = 0.1
@@ -9,9 +9,7 @@ def location_map_size(location) -> tuple[int, int]:
     if location.__class__.__name__ != "Location":
         raise TypeError("Object of type Location expected")
 
-    map = location.map
-    w, h, tile = map.width, map.height, map.tilewidth
-    return w * tile, h * tile
+    return location.size
 
 
 def player(source, *components, id=False, cache=True):
@@ -1,4 +1,3 @@
-import os
 import utils
 import esper
 import pygame
@@ -6,7 +5,7 @@ import pygame_menu
 
 
 from copy import deepcopy
-from utils.fs import ResourcePath, dir_count
+from utils.fs import ResourcePath
 from typing import Optional, Callable, Iterable
 
 from location import Position, SpawnPoint
@@ -104,16 +103,20 @@ def sprite(
 
 def sprite_component(animation, position):
     from render import Sprite
+    from transform import mask
 
     img = utils.convert.surface_from_animation(animation)
 
     sprite = utils.make.sprite(
         img,
         img.get_rect(center=position.coords),
-        pygame.mask.from_surface(img),
+        mask(img, img),
     )
 
-    return Sprite(img, sprite)
+    render = Sprite(img, sprite)
+    render._source = (img, 0.0)
+
+    return render
 
 
 def creature(
@@ -126,6 +129,7 @@ def creature(
     surface_preprocessor: Optional[
         Callable[[pygame.surface.Surface], pygame.surface.Surface]
     ] = None,
+    rotation_steps: Optional[int] = None,
 ):
     """Создаёт существо и возвращает id его сущности в базе данных сущностей.
 
@@ -139,6 +143,12 @@ def creature(
     *surface_preprocessor*: функция, переданная в качестве данного аргумента будет
     использована на каждом pygame.Surface в данной функции. Полезно, если прежде
     чем загружать картинку анимации, её нужно как-то обработать
+    *rotation_steps*: если указано, кадры существа заранее поворачиваются на
+    rotation_steps углов (см. transform.RotationAtlas)
+
+    Кадры загружаются только при создании первого существа с данным id и
+    общие для всех существ с этим id (см. animation.creature_frames), поэтому
+    surface_preprocessor и rotation_steps учитываются только в первый раз
 
     Примеры использования:
     ```python
@@ -164,7 +174,7 @@ def creature(
     from creature import Creature, Health
     from movement import Direction, Velocity
     from render import MakeRenderableRequest
-    from animation import States, Animation, PartType, Part
+    from animation import States, Animation, PartType, Part, creature_frames
 
     creature = world.create_entity(
         Id(id),
@@ -184,33 +194,18 @@ def creature(
     if Animation in map(type, extra_comps):
         return creature
 
-    def load_surface(path):
-        prep = surface_preprocessor
-        surf = pygame.image.load(path).convert_alpha()
-
-        if prep:
-            return prep(surf)
-
-        return surf
-
-    frames = []
-    for i in range(dir_count(ResourcePath.frame(id, "body"))):
-        frames.append(load_surface(ResourcePath.frame(id, "body", idx=i + 1)))
+    frames = creature_frames(id, surface_preprocessor, rotation_steps)
 
     parts = []
     for part in extra_parts:
-        part_frames = []
-        frame_number = dir_count(ResourcePath.frame(id, part))
+        part_frames = frames.part(part)
         animation_delay = (
-            400 // frame_number
+            400 // len(part_frames)
         )  # замедляем анимацию при небольшом количестве кадров
 
-        for i in range(frame_number):
-            part_frames.append(load_surface(ResourcePath.frame(id, part, idx=i + 1)))
-
         part_id = world.create_entity(
             Id(f"{id}:{part}"),
-            Animation(tuple(part_frames), animation_delay),
+            Animation(part_frames, animation_delay),
             MakeRenderableRequest(),
             Part(creature, PartType.from_str(part)),
         )
@@ -220,24 +215,12 @@ def creature(
 
         parts.append(part_id)
 
-    state_based_frames = {}
-    for dir, _, _ in os.walk(ResourcePath.frame(id)):
-        name = dir.split("/")[-1]
-        try:
-            state_type = (
-                StateType.from_str(name) if name != "body" else StateType.Stands
-            )
-        except KeyError:
-            continue
-        state_based_frames[state_type] = tuple(
-            load_surface(ResourcePath.frame(id, name, idx=i + 1))
-            for i in range(dir_count(ResourcePath.frame(id, name)))
-        )
-
+    # Словарь состояний у каждого существа свой: StateHandlingProcessor
+    # изменяет его, а сами кортежи кадров общие.
     world.add_component(
         creature,
         Animation(
-            tuple(frames), children=tuple(parts), state_based_frames=state_based_frames
+            frames.body, children=tuple(parts), state_based_frames=dict(frames.states)
         ),
     )
 
@@ -253,7 +236,7 @@ def item_comps(
     own_surface=False,
 ):
     from meta import Id
-    from item import Item, ItemNotFoundError, ITEMS
+    from item import Item, ItemNotFoundError, ITEMS, ITEM_RECORDS
 
     if id not in ITEMS:
         raise ItemNotFoundError(f"Предмет с идентификатором {id} не найден")
@@ -261,17 +244,12 @@ def item_comps(
     comps = []
 
     if not own_surface:
+        surf = ITEM_RECORDS[id].icon
 
-        def load_surface(path):
-            prep = surface_preprocessor
-            surf = pygame.image.load(path).convert_alpha()
-
-            if prep:
-                return prep(surf)
-
-            return surf
+        if prep := surface_preprocessor:
+            surf = prep(surf)
 
-        comps.append(Animation((load_surface(ResourcePath.frame(id, idx=1)),)))
+        comps.append(Animation((surf,)))
 
     return (
         Id(id),